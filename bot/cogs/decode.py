@@ -1,15 +1,22 @@
-import base64
-import gzip
-import json
+import asyncio
+import hashlib
+import io
 import logging
 import re
+import sqlite3
+from collections import Counter
+from pathlib import Path
+from typing import Optional
 
 from discord import File, Embed
 from discord.channel import DMChannel
-from discord.ext.commands import Bot, Cog
+from discord.ext.commands import Bot, Cog, Context, command
 from discord.message import Message
 
-from bot.helpers.qud_decode import Character
+from bot.helpers.build_stats import BuildStats, CATEGORIES
+from bot.helpers.cache import LRUCache
+from bot.helpers.qud_decode import BuildCodeError, Character, decode_build_code
+from bot.helpers.workers import run_job, WorkerTimeout
 from bot.shared import config
 
 log = logging.getLogger('bot.' + __name__)
@@ -29,6 +36,96 @@ log = logging.getLogger('bot.' + __name__)
 # base64 may end with a group of 4 characters instead
 _ = r"(?:[A-Za-z0-9+/]{4}){20}(?:[A-Za-z0-9+/]{4})*(?:[A-Za-z0-9+/]{2}==|[A-Za-z0-9+/]{3}=)?"
 base64_charcode = re.compile(_)
+MIN_CODE_LENGTH = 80
+# gzip data starts with the bytes 1f 8b 08, which always encode to these base64 characters
+GZIP_BASE64_MAGIC = 'H4sI'
+# Discord limits on embeds
+MAX_DESCRIPTION = 2048
+MAX_FIELDS = 25
+MAX_FIELD_VALUE = 1024
+MAX_EMBED_TEXT = 6000
+# ?buildstats category names, and how many entries it lists
+STATS_CATEGORIES = {
+    'genotypes': 'genotype',
+    'classes': 'subtype',
+    'subtypes': 'subtype',
+    'callings': 'calling',
+    'castes': 'caste',
+    'mutations': 'mutation',
+    'cybernetics': 'cybernetic',
+    'implants': 'cybernetic',
+    'locations': 'starting location',
+}
+STATS_TITLES = {
+    'genotype': 'Genotypes',
+    'subtype': 'Classes',
+    'calling': 'Callings',
+    'caste': 'Castes',
+    'mutation': 'Mutations',
+    'cybernetic': 'Cybernetics',
+    'starting location': 'Starting locations',
+}
+STATS_SUMMARY_LIMIT = 3  # of each category, when no category is given
+STATS_CATEGORY_LIMIT = 10
+STATS_MAX_LIMIT = 20
+
+# character sheet, thumbnail PNG, thumbnail file name and build for recent build codes, by hash
+# of the code, since popular builds get posted over and over. Thumbnails are shared between entries.
+sheet_cache = LRUCache(max_entries=512)
+
+
+def find_build_codes(content: str, counts: Counter, limit: int) -> list[str]:
+    """Return the possible build codes in a message, in order and without repeats, up to limit.
+
+    Most messages are rejected by cheap checks before the regex is run: a code is a run of at
+    least MIN_CODE_LENGTH characters without whitespace, and starts with GZIP_BASE64_MAGIC. The
+    regex is then only tried at the places where the magic appears. counts is updated with how
+    many messages were scanned and at which stage each was rejected.
+
+    There is no separate check that a long word is all base64 characters: codes are often posted
+    in `backticks` or right after other text, so the word around one isn't pure base64 anyway.
+    The alphabet is checked by the anchored regex, only from where a code can start."""
+    counts['scanned'] += 1
+    if len(content) < MIN_CODE_LENGTH \
+            or not any(len(word) >= MIN_CODE_LENGTH for word in content.split()):
+        counts['rejected: too short'] += 1
+        return []
+    start = content.find(GZIP_BASE64_MAGIC)
+    if start == -1:
+        counts['rejected: no gzip magic'] += 1
+        return []
+    codes = {}
+    while start != -1 and len(codes) < limit:
+        match = base64_charcode.match(content, start)
+        if match:
+            codes[match[0]] = None
+            start = match.end()
+        else:
+            start += 1
+        start = content.find(GZIP_BASE64_MAGIC, start)
+    if not codes:
+        counts['rejected: no regex match'] += 1
+        return []
+    counts['matched'] += 1
+    counts['codes'] += len(codes)
+    return list(codes)
+
+
+def code_hash(code: str) -> bytes:
+    return hashlib.sha256(code.encode('ascii')).digest()
+
+
+def character_sheet(code: str, max_size: int) -> tuple:
+    """Decode a build code, and return the character sheet, the class thumbnail PNG, a file name
+    for the thumbnail, and the Build for the build stats. Raises BuildCodeError if it isn't a
+    build code."""
+    data = decode_build_code(code, max_size)
+    try:
+        char = Character(data)
+        return char.make_sheet(), char.thumbnail(), char.thumbnail_filename(), char.build()
+    except (KeyError, IndexError, TypeError, AttributeError, ValueError) as e:
+        # valid JSON, but not a build the decoder understands (unknown class, missing module...)
+        raise BuildCodeError(f'not a character build ({e!r})')
 
 
 class Decode(Cog):
@@ -36,6 +133,14 @@ class Decode(Cog):
     def __init__(self, bot: Bot):
         self.bot = bot
         self.config = config['Decode']
+        self.prefilter_counts = Counter()
+        # limits for decoding a possible build code on the worker pool
+        self.max_size = self.config.get('max decoded size', 1024 * 1024)
+        self.time_budget = self.config.get('time budget', 5)
+        self.max_codes = min(self.config.get('max codes per message', 5), MAX_FIELDS)
+        self.build_stats = BuildStats(Path(self.config.get('build stats',
+                                                           Path(config['Log folder'],
+                                                                'builds.sqlite3'))))
 
     @Cog.listener()
     async def on_message(self, message: Message):
@@ -46,30 +151,109 @@ class Decode(Cog):
         if message.author.id in self.config['ignore'] or message.author == self.bot.user:
             return  # ignore ignored users and bots
 
-        # Is there a base64-encoded build code (post-2.0.202?)
-        match = base64_charcode.search(message.content)
-        if match:
-            # the real test - it may match the regex, but
-            # does it base64-decode, gunzip, and json parse cleanly?
-            try:
-                decode = base64.b64decode(match[0])
-                unzip = gzip.decompress(decode).decode(encoding='utf-8')
-                code = json.loads(unzip)
-            except Exception:  # noqa
-                pass  # It probably wasn't a build code! Do nothing.
-            else:
-                char = Character(code)
-                sheet = char.make_sheet()
+        # Are there base64-encoded build codes (post-2.0.202?)
+        codes = find_build_codes(message.content, self.prefilter_counts, self.max_codes)
+        if not codes:
+            return
+        log.debug(f'Build code prefilter: {dict(self.prefilter_counts)}')
+        # decode them all at once, and answer with a single message
+        entries = await asyncio.gather(*(self.character_sheet(code, message) for code in codes))
+        builds = [(code, entry[3]) for code, entry in zip(codes, entries) if entry is not None]
+        entries = [entry for entry in entries if entry is not None]
+        if len(entries) == 0:
+            return
+        sheet, thumbnail, img_filename, _ = entries[0]
+        if len(entries) == 1:
+            response = f'```{sheet}```'
+            if len(response) > MAX_DESCRIPTION:
+                await message.channel.send('The character sheet for that build code'
+                                           ' is too large to fit into a Discord message.')
+                return await self.record_builds(builds, message)
+            embed = Embed(description=response, color=0x2AA18B)
+        else:
+            # one field per character; the embed can only have one thumbnail, the first one's
+            embed = Embed(color=0x2AA18B)
+            embed_text = 0
+            for number, (sheet, _, _, _) in enumerate(entries, start=1):
+                name = f'Build code {number}'
                 response = f'```{sheet}```'
-                if len(response) > 2048:
-                    await message.channel.send('The character sheet for that build code'
-                                               ' is too large to fit into a Discord message.')
-                else:
-                    thumbnail = char.tile.get_big_bytesio()
-                    thumbnail.seek(0)
-                    img_filename = ''.join(
-                        ch for ch in char.subtype if ch.isalnum()) + '.png'
-                    embedfile = File(fp=thumbnail, filename=f'{img_filename}')
-                    embed = Embed(description=response, color=0x2AA18B)
-                    embed.set_thumbnail(url=f'attachment://{img_filename}')
-                    await message.channel.send(embed=embed, file=embedfile)
+                if len(response) > MAX_FIELD_VALUE:
+                    response = 'This character sheet is too large to fit into a Discord message.'
+                if embed_text + len(name) + len(response) > MAX_EMBED_TEXT:
+                    break
+                embed_text += len(name) + len(response)
+                embed.add_field(name=name, value=response, inline=False)
+        embedfile = File(fp=io.BytesIO(thumbnail), filename=f'{img_filename}')
+        embed.set_thumbnail(url=f'attachment://{img_filename}')
+        await message.channel.send(embed=embed, file=embedfile)
+        await self.record_builds(builds, message)
+
+    async def record_builds(self, builds: list[tuple], message: Message):
+        """Add the builds decoded from a message to the build stats."""
+        loop = asyncio.get_running_loop()
+        channel = None if isinstance(message.channel, DMChannel) else message.channel.id
+        for code, build in builds:
+            try:
+                await loop.run_in_executor(None, self.build_stats.record, build, code_hash(code),
+                                           channel, message.author.id)
+            except sqlite3.Error as e:
+                log.error(f'Could not record a build in the build stats: {e}')
+
+    @command()
+    async def buildstats(self, ctx: Context, *args):
+        """ Shows the most popular genotypes, classes, mutations, cybernetics and
+            starting locations of the build codes posted in the build channels.
+            Add a category to see more of it, and how many to list."""
+        log.info(f'({ctx.message.channel}) <{ctx.message.author}> {ctx.message.content}')
+        limit = None
+        if args and args[-1].isdecimal():
+            limit = max(1, min(int(args[-1]), STATS_MAX_LIMIT))
+            args = args[:-1]
+        if len(args) > 1 or (len(args) == 1 and args[0].lower() not in STATS_CATEGORIES):
+            return await ctx.send('Usage: `?buildstats [category] [count]`, where the category'
+                                  ' is one of: ' + ', '.join(STATS_CATEGORIES))
+        if len(args) == 1:
+            categories = [STATS_CATEGORIES[args[0].lower()]]
+            limit = limit or STATS_CATEGORY_LIMIT
+        else:
+            categories = CATEGORIES
+            limit = limit or STATS_SUMMARY_LIMIT
+        loop = asyncio.get_running_loop()
+        total = await loop.run_in_executor(None, self.build_stats.total)
+        if total == 0:
+            return await ctx.send("I haven't seen any build codes yet.")
+        lines = [f'Most popular of {total} builds posted:']
+        for category in categories:
+            top = await loop.run_in_executor(None, self.build_stats.top, category, limit)
+            if top:
+                ranking = ', '.join(f'{value} ({count * 100 / total:.0f}%)'
+                                    for value, count in top)
+                lines.append(f'**{STATS_TITLES[category]}**: {ranking}')
+        await ctx.send('\n'.join(lines))
+
+    async def character_sheet(self, code: str, message: Message) -> Optional[tuple]:
+        """Return the character sheet, thumbnail PNG, thumbnail file name and Build for a possible
+        build code from the cache, or else decode it on the worker pool. Returns None if it turns
+        out not to be a build code."""
+        key = code_hash(code)
+        entry = sheet_cache.get(key)
+        if entry is not None:
+            stats = sheet_cache.stats()
+            log.info(f"Build code cache hit ({stats['hits']} hits, {stats['misses']} misses,"
+                     f" {stats['entries']} cached)")
+            return entry
+        # the real test - it may match the regex, but
+        # does it base64-decode, gunzip, and json parse cleanly?
+        try:
+            entry = await run_job('build code', character_sheet, code, self.max_size,
+                                  timeout=self.time_budget)
+        except BuildCodeError as e:
+            # It probably wasn't a build code! Do nothing.
+            log.info(f'Rejected possible build code from {message.author}: {e}')
+            return None
+        except WorkerTimeout:
+            log.warning(f'Rejected possible build code from {message.author}:'
+                        f' not decoded within {self.time_budget} s')
+            return None
+        sheet_cache.put(key, entry)
+        return entry
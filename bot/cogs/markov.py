@@ -1,11 +1,28 @@
 """Commands for random text generation."""
-from bot.helpers.corpus import corpus
+from bot.helpers.corpus import corpus, sentence_pool
+from bot.helpers.markov_trie import MAX_ORDER, SuffixTrie
 import logging
+import time
+from itertools import islice
+from typing import NamedTuple, Optional
 
 from discord.ext.commands import Cog, Bot, Context, command
 
+from bot.shared import config
+
 log = logging.getLogger('bot.' + __name__)
 
+INCORPUS_PAGE_SIZE = 20  # keeps the message under the Discord length limit
+INCORPUS_CURSOR_TTL = 600  # seconds
+
+
+class IncorpusCursor(NamedTuple):
+    """Where a user's last ?incorpus page ended."""
+    args: tuple
+    page: int
+    next_key: int  # key id of the first pair on the next page
+    expires: float
+
 
 class Markov(Cog):
     """Markov shenanigans!"""
@@ -13,30 +30,67 @@ class Markov(Cog):
     def __init__(self, bot: Bot):
         self.bot = bot
         self.corpus = corpus
+        self.cursors: dict[int, IncorpusCursor] = {}  # user id -> ?incorpus cursor
+        sentence_pool.start(bot.loop)
+        # optional variable-order model, for ?sleeptalk seeds that aren't in the corpus
+        self.trie: Optional[SuffixTrie] = None
+        order = (config.get('Markov') or {}).get('variable order')
+        if order is not None:
+            if isinstance(order, int) and 1 <= order <= MAX_ORDER:
+                self.bot.loop.run_in_executor(None, self.build_trie, order)
+            else:
+                log.error(f'Markov "variable order" must be a whole number from 1 to {MAX_ORDER},'
+                          f' not {order!r}; the variable-order model is off')
+
+    def build_trie(self, order: int):
+        # runs in an executor whose future nobody awaits, so log failures here
+        try:
+            self.trie = SuffixTrie.from_json(max_order=order)
+        except Exception as e:
+            log.exception(e)
 
     @command()
     async def incorpus(self, ctx: Context, *args):
         """ Returns all corpus phrases that contain the arguments, ignoring
-            capitalization and punctuation."""
+            capitalization and punctuation. Shows 20 phrases at a time: add
+            "page" and a page number after the phrase to see the rest."""
         log.info(f'({ctx.message.channel}) <{ctx.message.author}> {ctx.message.content}')
+        page = 1
+        # 'page N' after the phrase, so that a phrase can end in a number ('chapter 3')
+        if len(args) >= 3 and args[-2].lower() == 'page' and args[-1].isdecimal():
+            page = max(1, int(args[-1]))
+            args = args[:-2]
         if len(args) == 0:
-            return await ctx.send("Usage: `?incorpus [1-2 word phrase]`\n"
+            return await ctx.send("Usage: `?incorpus [1-2 word phrase] [page N]`\n"
                                   + "If the words are found in the corpus, I will return the actual"
                                   + " phrases found. Remove the brackets!")
         if len(args) > 2:
             return await ctx.send("That's too many words! You only need one or two.")
-        msg = self.corpus.get_pairs(args)
-        itemstruncated = 0
-        if len(msg) == 0:
-            return await ctx.send("That phrase doesn't seem to be in the corpus.")
-        if len(msg) > 20:
-            # Truncate list because some lists surpass 4k message limit.
-            # TODO: add parameter to offset or paginate to let people see the rest
-            itemstruncated = len(msg)-20
-            msg = msg[:20]
-        msgstr = "\"" + '\", \"'.join(msg) + "\""
-        if itemstruncated > 0:
-            msgstr += f", *...{itemstruncated} additional pairs hidden*"
+        # each key matches at most once, so later pages are empty (and their skip can overflow
+        # islice() for huge page numbers)
+        if page > 1 and (page - 1) * INCORPUS_PAGE_SIZE >= len(self.corpus.keys):
+            return await ctx.send("There aren't that many pages of phrases.")
+        # resume from where this user's previous page ended, or else skip the earlier pages
+        now = time.monotonic()
+        self.cursors = {user: cursor for user, cursor in self.cursors.items()
+                        if cursor.expires > now}
+        cursor = self.cursors.get(ctx.author.id)
+        if cursor is not None and cursor.args == args and cursor.page == page - 1:
+            start, skip = cursor.next_key, 0
+        else:
+            start, skip = 0, (page - 1) * INCORPUS_PAGE_SIZE
+        # one extra match, to know whether there is a next page
+        matches = list(islice(self.corpus.iter_pairs(args, start=start),
+                              skip, skip + INCORPUS_PAGE_SIZE + 1))
+        if len(matches) == 0:
+            if page == 1:
+                return await ctx.send("That phrase doesn't seem to be in the corpus.")
+            return await ctx.send("There aren't that many pages of phrases.")
+        msgstr = "\"" + '\", \"'.join(pair for _, pair in matches[:INCORPUS_PAGE_SIZE]) + "\""
+        if len(matches) > INCORPUS_PAGE_SIZE:
+            self.cursors[ctx.author.id] = IncorpusCursor(args, page, matches[-1][0],
+                                                         now + INCORPUS_CURSOR_TTL)
+            msgstr += f", *...more with* `?incorpus {' '.join(args)} page {page + 1}`"
         return await ctx.send(f"These phrases are in the corpus: {msgstr}")
 
     @command()
@@ -45,15 +99,18 @@ class Markov(Cog):
 
         Does not require arguments, but can take one or two words to use
         as opening words. Due to how markov chains work, they must already
-        exist in the corpus (word bank)."""
+        exist in the corpus (word bank), unless the variable-order model is
+        turned on in the config."""
         log.info(f'({ctx.message.channel}) <{ctx.message.author}> {ctx.message.content}')
 
-        seed = ""
-        if len(args) >= 1:
-            if len(args) >= 3:
-                return await ctx.send("You need less than 3 words!")
-            seed = self.corpus.get_pair(args)
-            if seed is None:
+        if len(args) == 0:
+            return await ctx.send(sentence_pool.get())
+        if len(args) >= 3:
+            return await ctx.send("You need less than 3 words!")
+        seed = self.corpus.get_pair(args)
+        if seed is None:
+            if self.trie is None:
                 return await ctx.send("That phrase doesn't seem to be in the corpus.")
+            return await ctx.send(self.trie.generate_sentence(' '.join(args)))
         msg = self.corpus.generate_sentence(seed)
         return await ctx.send(msg)
@@ -2,15 +2,26 @@
 import io
 import logging
 import re
+import time
 from discord.ext.commands import CommandError
 
 from discord import File
 from discord.ext.commands import Cog, Context, command
 
-from bot.helpers.font import drawttf, DrawException
+from bot.helpers.cache import LRUCache
+from bot.helpers.font import drawttf_png, drawttf_key, drawconversation_png, drawtypewriter_gif, \
+    DrawException
+from bot.helpers.workers import run_job, WorkerTimeout
+from bot.shared import config
 
 log = logging.getLogger('bot.' + __name__)
 
+# Regex tester: https://regex101.com/r/O0RVHC/2
+SAY_SYNTAX = re.compile(r'(?P<type>-\w+)?(:)?(?(2)(\'(?P<option>.+?)\'|(?P<option2>\w+)))\s?(?P<text>.+)', flags=re.MULTILINE | re.DOTALL) # noqa E501
+
+# encoded PNGs of recent messages, since the same memes get requested over and over
+png_cache = LRUCache(max_entries=256, max_bytes=32 * 1024 * 1024)
+
 
 class Say(Cog):
     """Reads the sent message in the specific channel and posts it."""
@@ -33,30 +44,83 @@ class Say(Cog):
 
               Example: ?say -p There are hostiles nearby!
         """
-        # Regex tester: https://regex101.com/r/O0RVHC/2
         log.info(f'({ctx.message.channel}) <{ctx.message.author}> {ctx.message.content}')
         msg = ctx.message.content[5:]
-        exp = re.compile(r'(?P<type>-\w+)?(:)?(?(2)(\'(?P<option>.+?)\'|(?P<option2>\w+)))\s?(?P<text>.+)', flags=re.MULTILINE | re.DOTALL) # noqa E501
-        match = exp.fullmatch(msg)
-        if match is None:
-            raise CommandError('wrong syntax: ' + msg)
-        if match.group('text') is None:
-            raise CommandError('wrong syntax: ' + msg)
-        optionalarg = match.group('option')
-        if optionalarg is None:
-            optionalarg = match.group('option2')
-            if optionalarg is None:
-                if hasattr(ctx.message.author, 'nick'):
-                    optionalarg = ctx.message.author.nick
-                else:
-                    optionalarg = ctx.message.author.name
+        text, bordertype, optionalarg = parse_say(ctx, msg)
         try:
-            image = drawttf(match.group('text'), match.group('type'), optionalarg)
+            key = drawttf_key(text, bordertype, optionalarg)
+            png = None if key is None else png_cache.get(key)
+            if png is None:
+                png_b = await run_job(f'?say from {ctx.message.author}', drawttf_png,
+                                      text, bordertype, optionalarg,
+                                      timeout=(config.get('Say') or {}).get('time budget', 10))
+                if key is not None:  # randomized shaders are drawn afresh every time
+                    png_cache.put(key, png_b.getvalue())
+            else:
+                stats = png_cache.stats()
+                log.info(f"?say cache hit ({stats['hits']} hits, {stats['misses']} misses,"
+                         f" {stats['entries']} cached)")
+                png_b = io.BytesIO(png)
         except DrawException as e:
             return await ctx.send(e.message + ' See `?help say` for syntax.')
+        except WorkerTimeout:
+            return await ctx.send('Sorry, I was too busy to draw that. Try again in a moment.')
         else:
-            png_b = io.BytesIO()
-            image.save(png_b, format='png')
-            png_b.seek(0)
             return await ctx.send(file=File(fp=png_b,
-                                  filename=f'{ctx.message.author.id}-{match.group("text")}.png'))
+                                  filename=f'{ctx.message.author.id}-{text}.png'))
+
+    @command(aliases=['convo'])
+    async def conversation(self, ctx: Context):
+        """Make cryptogull draw a whole conversation in one image!
+
+        Format: ?conversation [gif]
+                [-{border}[:{title}]] {text}
+                [-{border}[:{title}]] {text}
+                ...
+
+        Each line is drawn as its own message box, the same way as ?say
+        (see `?help say`), up to 8 of them. Add 'gif' after the command to
+        type the conversation out as an animation instead.
+
+          Example: ?conversation
+                   -d:Mehmet Live and drink, friend.
+                   -d:'Warden Yrame' Hostiles approach!
+                   -p There are hostiles nearby!
+        """
+        log.info(f'({ctx.message.channel}) <{ctx.message.author}> {ctx.message.content}')
+        msg = ctx.message.content[len(ctx.prefix) + len(ctx.invoked_with):].strip()
+        first_word, *_ = msg.split(maxsplit=1) or ['']
+        animated = first_word.lower() == 'gif'
+        if animated:
+            msg = msg[len(first_word):]
+        panels = [parse_say(ctx, line.strip()) for line in msg.split('\n') if line.strip()]
+        budget = (config.get('Say') or {}).get('conversation time budget', 20)
+        draw = drawtypewriter_gif if animated else drawconversation_png
+        try:
+            filedata = await run_job(f'?conversation from {ctx.message.author}', draw,
+                                     panels, time.perf_counter() + budget, timeout=budget)
+        except DrawException as e:
+            return await ctx.send(e.message + ' See `?help conversation` for syntax.')
+        except WorkerTimeout:
+            return await ctx.send('Sorry, I was too busy to draw that. Try again in a moment.')
+        ext = '.gif' if animated else '.png'
+        return await ctx.send(file=File(fp=filedata,
+                              filename=f'{ctx.message.author.id}-conversation{ext}'))
+
+
+def parse_say(ctx: Context, msg: str) -> tuple:
+    """Parse a ?say message into the text, border type and title to draw it with."""
+    match = SAY_SYNTAX.fullmatch(msg)
+    if match is None:
+        raise CommandError('wrong syntax: ' + msg)
+    if match.group('text') is None:
+        raise CommandError('wrong syntax: ' + msg)
+    optionalarg = match.group('option')
+    if optionalarg is None:
+        optionalarg = match.group('option2')
+        if optionalarg is None:
+            if hasattr(ctx.message.author, 'nick'):
+                optionalarg = ctx.message.author.nick
+            else:
+                optionalarg = ctx.message.author.name
+    return match.group('text'), match.group('type'), optionalarg
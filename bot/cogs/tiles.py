@@ -4,7 +4,7 @@ import logging
 from discord import File
 from discord.ext.commands import Cog, Bot, Context, command
 
-from bot.helpers.corpus import corpus
+from bot.helpers.corpus import corpus, sentence_pool
 from bot.helpers.tiles import get_tile_data, TileError, get_random_tile_name, get_tile_data_by_file
 
 log = logging.getLogger('bot.' + __name__)
@@ -16,6 +16,7 @@ class Tiles(Cog):
     def __init__(self, bot: Bot):
         self.bot = bot
         self.corpus = corpus
+        sentence_pool.start(bot.loop)
 
     @command()
     async def tile(self, ctx: Context, *args):
@@ -120,7 +121,7 @@ class Tiles(Cog):
     @command()
     async def horoscope(self, ctx: Context, *args):
         """Alias for ?randomtile recolor random, with a special reading from Cryptogull."""
-        msg = self.corpus.generate_sentence()
+        msg = sentence_pool.get()
         return await self.randomtile(ctx, "recolor", "random", reading=msg)
 
 
@@ -6,6 +6,7 @@ API help:
 https://wiki.cavesofqud.com/api.php?action=help&modules=query%2Bsearch
 """
 
+import asyncio
 import logging
 from typing import Optional
 
@@ -28,6 +29,7 @@ class Wiki(Cog):
         self.config = config['Wiki']
         self.basic_limit = self.config['basic search limit']
         self.fulltext_limit = self.config['fulltext search limit']
+        self.search_time_budget = self.config.get('search time budget', 5)
         self.url = self.make_wiki_url('api.php')
 
     @command()
@@ -104,13 +106,39 @@ class Wiki(Cog):
         result_limit = self.basic_limit if limit is None else limit
 
         # opensearch (preserved due to better partial title matching - ex: yonder => yondercane)
+        # and query&list=search are independent, so they are sent at the same time, and whatever
+        # has answered within the time budget is used
         o_limit = str(max(1, int(result_limit) // 4))  # one-fourth of result limit, rounded down
-        o_err, o_titles, o_urls = await api_opensearch(self.url, query, o_limit,
-                                                       query_namespaces)
-        # query&list=search
-        err, titles, urls, _, _ = await api_query_list_search(self.url, query, result_limit,
-                                                              query_namespaces,
-                                                              retrieve_snippets=False)
+        searches = {
+            'opensearch': asyncio.create_task(api_opensearch(self.url, query, o_limit,
+                                                             query_namespaces)),
+            'query&list=search': asyncio.create_task(
+                api_query_list_search(self.url, query, result_limit, query_namespaces,
+                                      retrieve_snippets=False)),
+        }
+        done, pending = await asyncio.wait(searches.values(), timeout=self.search_time_budget)
+        for task in pending:
+            task.cancel()
+        # a search that failed is left out just like one that was too slow
+        results = {}
+        for name, task in searches.items():
+            if task not in done:
+                log.warning(f'Wiki search for "{query}": no answer from {name}'
+                            f' within {self.search_time_budget} s')
+            elif task.exception() is not None:
+                log.warning(f'Wiki search for "{query}": {name} failed:'
+                            f' {task.exception()!r}')
+            else:
+                results[name] = task.result()
+        opensearch = results.get('opensearch')
+        opensearch_ok = opensearch is not None and opensearch[0] is None
+        if 'query&list=search' in results:
+            err, titles, urls, _, _ = results['query&list=search']
+        elif opensearch_ok:
+            err, titles, urls = opensearch  # fewer results, but better than none
+        else:
+            return await send_wiki_error_message(ctx, '*The wiki search failed or took too long,'
+                                                      ' please try again later.*')
         if err is not None:
             try:
                 info = ''.join(err['info'])
@@ -120,8 +148,8 @@ class Wiki(Cog):
                 return await ctx.send('Sorry, that query caused a search error with no'
                                       ' error message. Exception logged.')
 
-        elif o_err is None:
-            titles, urls = merge_wikipage_results((o_titles, o_urls), (titles, urls), result_limit)
+        elif opensearch_ok and 'query&list=search' in results:
+            titles, urls = merge_wikipage_results(opensearch[1:], (titles, urls), result_limit)
 
         if len(titles) == 1:
             return await send_single_wiki_page(ctx, self.url, titles[0], urls[0],
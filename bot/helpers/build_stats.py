@@ -0,0 +1,134 @@
+"""A persistent store of the character builds posted in the build code channels.
+
+Every decoded build is appended to the builds table of a local SQLite database. Along with it,
+the build_counts table keeps a running count of each genotype, subtype (class), mutation,
+cybernetic and starting location seen, updated in the same transaction. Subtypes are counted
+again as callings or castes, depending on the genotype. Popularity queries read
+only those counts, through an index ordered by count, so answering a top-N query costs the same
+however many builds have been recorded; the builds table itself is never rescanned.
+"""
+import json
+import logging
+import re
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import NamedTuple, Optional
+
+log = logging.getLogger('bot.' + __name__)
+
+# categories counted in build_counts, besides TOTAL
+CATEGORIES = ('genotype', 'subtype', 'mutation', 'cybernetic', 'starting location')
+# the subtype again, counted under the kind of subtype the genotype picks from
+SUBTYPE_CATEGORIES = ('calling', 'caste')
+TOTAL = 'builds'  # category whose single row counts all recorded builds
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS builds (
+    id INTEGER PRIMARY KEY,
+    posted REAL NOT NULL,
+    channel INTEGER,
+    author INTEGER,
+    code_hash BLOB NOT NULL,
+    genotype TEXT,
+    subtype TEXT,
+    selections TEXT,
+    starting_location TEXT
+);
+CREATE TABLE IF NOT EXISTS build_counts (
+    category TEXT NOT NULL,
+    value TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (category, value)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS build_counts_top ON build_counts (category, count DESC, value);
+"""
+
+UPSERT_COUNT = """
+INSERT INTO build_counts (category, value, count) VALUES (?, ?, 1)
+ON CONFLICT (category, value) DO UPDATE SET count = count + 1
+"""
+
+# counts the subtype categories from the builds table, for databases recorded before they existed
+BACKFILL_SUBTYPE_COUNTS = """
+INSERT INTO build_counts (category, value, count)
+SELECT CASE genotype WHEN 'True Kin' THEN 'caste' ELSE 'calling' END, subtype, COUNT(*)
+FROM builds GROUP BY 1, subtype
+"""
+
+# Unstable Genome stacks are listed as 'Unstable Genome x3', but count as the one mutation
+STACK_SUFFIX = re.compile(r' x\d+$')
+
+
+class Build(NamedTuple):
+    """What is recorded of a character build."""
+    genotype: str
+    subtype: str
+    selection_noun: str  # 'Mutation' or 'Cybernetic'
+    selections: tuple[str, ...]
+    starting_location: str
+
+
+def subtype_category(genotype: str) -> str:
+    """Return whether a genotype picks a caste (True Kin) or a calling (Mutated Humans)."""
+    return 'caste' if genotype == 'True Kin' else 'calling'
+
+
+class BuildStats:
+    """The build store. Safe to use from several threads, but every call does disk I/O, so
+    coroutines should run them in an executor."""
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        with self.lock, self.db:
+            self.db.executescript(SCHEMA)
+            backfill = self.db.execute('SELECT NOT EXISTS (SELECT 1 FROM build_counts'
+                                       ' WHERE category IN (?, ?))',
+                                       SUBTYPE_CATEGORIES).fetchone()[0]
+            if backfill:
+                self.db.execute(BACKFILL_SUBTYPE_COUNTS)
+        log.info(f'Opened build stats at {path}: {self.total()} builds recorded')
+
+    def record(self, build: Build, code_hash: bytes, channel: Optional[int] = None,
+               author: Optional[int] = None):
+        """Append a build, and add it to the running counts."""
+        counts = [(TOTAL, ''),
+                  ('genotype', build.genotype),
+                  ('subtype', build.subtype),
+                  (subtype_category(build.genotype), build.subtype),
+                  ('starting location', build.starting_location)]
+        category = build.selection_noun.lower()
+        selections = dict.fromkeys(STACK_SUFFIX.sub('', selection)
+                                   for selection in build.selections)
+        counts.extend((category, selection) for selection in selections)
+        with self.lock, self.db:  # one transaction, so the counts always match the builds
+            self.db.execute('INSERT INTO builds (posted, channel, author, code_hash, genotype,'
+                            ' subtype, selections, starting_location)'
+                            ' VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                            (time.time(), channel, author, code_hash, build.genotype,
+                             build.subtype, json.dumps(build.selections),
+                             build.starting_location))
+            self.db.executemany(UPSERT_COUNT, counts)
+
+    def top(self, category: str, limit: int = 5) -> list[tuple[str, int]]:
+        """Return the most common values of a category with their counts, most common first."""
+        if category not in CATEGORIES + SUBTYPE_CATEGORIES:
+            raise ValueError(f'unknown category {category!r}')
+        with self.lock:
+            return self.db.execute('SELECT value, count FROM build_counts WHERE category = ?'
+                                   ' ORDER BY count DESC, value LIMIT ?',
+                                   (category, limit)).fetchall()
+
+    def total(self) -> int:
+        """Return how many builds have been recorded."""
+        with self.lock:
+            row = self.db.execute('SELECT count FROM build_counts WHERE category = ?'
+                                  " AND value = ''", (TOTAL,)).fetchone()
+        return 0 if row is None else row[0]
+
+    def close(self):
+        with self.lock:
+            self.db.close()
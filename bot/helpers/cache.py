@@ -0,0 +1,121 @@
+"""Small in-process caches shared by the helpers."""
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Hashable, Optional
+
+
+class LRUCache:
+    """A bounded mapping that evicts its least recently used entries first.
+
+    Bounded by entry count, and optionally by the total size of the stored values as measured by
+    the sizeof callable. Counts hits, misses and evictions so they can be reported. Safe to share
+    between the event loop and executor threads."""
+
+    def __init__(self, max_entries: int, max_bytes: Optional[int] = None,
+                 sizeof: Callable = len):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._entries
+
+    def get(self, key: Hashable, default=None):
+        """Return the value for key and mark it as recently used, or default if not present."""
+        with self._lock:
+            try:
+                value = self._entries[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key: Hashable, value):
+        """Store a value, evicting old entries as needed. Values larger than max_bytes on their
+        own are not stored."""
+        size = self.sizeof(value) if self.max_bytes is not None else 0
+        if self.max_bytes is not None and size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._discard(key)
+            self._entries[key] = value
+            self.bytes += size
+            while len(self._entries) > self.max_entries or \
+                    (self.max_bytes is not None and self.bytes > self.max_bytes):
+                self._discard(next(iter(self._entries)))
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+
+    def stats(self) -> dict:
+        """Return the cache metrics as a dictionary."""
+        lookups = self.hits + self.misses
+        return {
+            'entries': len(self._entries),
+            'bytes': self.bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+        }
+
+    def _discard(self, key: Hashable):
+        value = self._entries.pop(key)
+        if self.max_bytes is not None:
+            self.bytes -= self.sizeof(value)
+
+
+class TTLCache(LRUCache):
+    """An LRUCache whose entries also expire, ttl seconds after they were stored.
+
+    Each put() can give its own ttl, so responses that go stale at different rates can share one
+    cache and its bounds. Expired entries are dropped when next looked up (counting as a miss and
+    an expiration), or evicted like any other entry if they are never looked up again."""
+
+    def __init__(self, max_entries: int, ttl: float, max_bytes: Optional[int] = None,
+                 sizeof: Callable = len, clock: Callable[[], float] = time.monotonic):
+        super().__init__(max_entries, max_bytes, sizeof=lambda entry: sizeof(entry[1]))
+        self.ttl = ttl
+        self.clock = clock
+        self.expirations = 0
+
+    def get(self, key: Hashable, default=None):
+        """Return the value for key and mark it as recently used, or default if not present or
+        expired."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] <= self.clock():
+                self._discard(key)
+                self.expirations += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key: Hashable, value, ttl: Optional[float] = None):
+        """Store a value for ttl seconds (the cache's default ttl if not given)."""
+        super().put(key, (self.clock() + (self.ttl if ttl is None else ttl), value))
+
+    def stats(self) -> dict:
+        stats = super().stats()
+        stats['expirations'] = self.expirations
+        return stats
@@ -1,8 +1,83 @@
+import asyncio
+import hashlib
 import json
+import logging
 import random
 import re
+import struct
+import sys
+import time
+from array import array
+from bisect import bisect_left
+from collections import Counter, deque
+from itertools import accumulate
+from pathlib import Path
+from typing import Iterator
+
 from bot.shared import config
 
+log = logging.getLogger('bot.' + __name__)
+
+# Compiled corpus file, written next to the logs so startup doesn't have to parse and rebuild the
+# chain from the game's JSON every time. Layout:
+#     magic           4 bytes, b'QMC2'
+#     header length   4 bytes, unsigned little-endian
+#     header          UTF-8 JSON: {"source": sha256 of the JSON corpus, "byteorder", "order",
+#                     "OpeningWords", "sections": {name: [start, end]}}
+#     sections        back to back, at the [start, end) offsets after the header:
+#                     vocabulary, keys              string lists joined by SEPARATOR
+#                     offsets, successors           unsigned ints ('I')
+#                     next_keys                     signed ints ('i'), -1 for no next key
+#                     probability                   doubles ('d'), per successor, see alias_table()
+#                     alias                         unsigned ints ('I'), per successor
+#                     word_index.words, first_word_index.words      string lists
+#                     word_index.offsets, word_index.postings, first_word_index.offsets,
+#                     first_word_index.postings     unsigned ints ('I')
+# Files with another magic (b'QMC1' had no probability or alias) are recompiled.
+COMPILED_NAME = 'LibraryCorpus.compiled'
+MAGIC = b'QMC2'
+HEADER = struct.Struct('<4sI')
+SEPARATOR = '\u0001'  # the game's own separator between successors, so never part of a word
+# unseeded sentences kept ready by the sentence pool, and how many it generates between yields
+POOL_SIZE = 64
+POOL_BATCH = 8
+# batches in a row that may come up empty before the pool stops refilling until it is next used,
+# and how long it waits after each of those before trying again (times the number of failures)
+POOL_MAX_FAILURES = 5
+POOL_RETRY_DELAY = 0.1  # seconds
+
+# the words that \b boundaries delimit, for looking up phrases in the corpus
+WORD = re.compile(r"\w+")
+# stand-in successor that generate_sentence() replaces with a secret
+SECRET = "#MAKESECRET#"
+
+
+JSON_PATH = Path(config['Qud install folder'], "CoQ_Data/StreamingAssets/Base/LibraryCorpus.json")
+COMPILED_PATH = Path(config['Log folder'], COMPILED_NAME)
+
+
+def alias_table(counts: list[int]) -> tuple[list[float], list[int]]:
+    """Build a Walker alias table (Vose's method) for picking index i with probability
+    counts[i] / sum(counts): pick a column uniformly, then keep it with probability[column] or
+    take alias[column] instead."""
+    columns = len(counts)
+    if counts.count(counts[0]) == columns:  # uniform, including a single successor
+        return [1.0] * columns, list(range(columns))
+    total = sum(counts)
+    scaled = [count * columns / total for count in counts]
+    probability = [1.0] * columns
+    alias = list(range(columns))
+    small = [column for column, share in enumerate(scaled) if share < 1]
+    large = [column for column, share in enumerate(scaled) if share >= 1]
+    while small and large:
+        less, more = small.pop(), large.pop()
+        probability[less] = scaled[less]
+        alias[less] = more
+        scaled[more] += scaled[less] - 1
+        (small if scaled[more] < 1 else large).append(more)
+    # whatever is left over is 1 up to rounding errors, so keeps probability 1
+    return probability, alias
+
 
 class Corpus:
     """
@@ -11,13 +86,31 @@ class Corpus:
     """
 
     def __init__(self):
-        self.chain: dict[str: list[str]] = {}
+        # The chain is stored with integer ids rather than as a dict of lists of strings, which
+        # would hold a separate string object for every occurrence of every word:
+        #  - keys[k] is the k-th chain key ("word word"), and key_ids maps it back to k.
+        #  - The successors of key k are successors[offsets[k]:offsets[k + 1]], as ids into
+        #    vocabulary, and next_keys holds the id of the key that each successor leads to
+        #    (or -1 if the chain stops there).
+        #  - probability and alias hold the Walker alias table of each key's successors, so that
+        #    they are picked as often as they appear in the corpus (see alias_table()).
+        self.keys: list[str] = []
+        self.key_ids: dict[str: int] = {}
+        self.vocabulary: list[str] = []
+        self.offsets = array('I')
+        self.successors = array('I')
+        self.next_keys = array('i')
+        self.probability = array('d')
+        self.alias = array('I')
         self.order = 2
         self.openingwords = {}
+        # inverted indexes for get_pairs: lowercased word -> ids of the chain keys containing that
+        # word, and lowercased word -> ids of the chain keys starting with that word.
+        self.word_index = WordIndex.from_lists({})
+        self.first_word_index = WordIndex.from_lists({})
 
-        # Load corpus from game files
-        self.load_json(config['Qud install folder'] +
-                       "/CoQ_Data/StreamingAssets/Base/LibraryCorpus.json")
+        # Load corpus from game files, or from the compiled copy of them
+        self.load(JSON_PATH, COMPILED_PATH)
 
     def get_pair(self, seed):
         # Finds a pair, but only one. Returns None if no pairs were found at all.
@@ -29,66 +122,122 @@ class Corpus:
     def get_pairs(self, seed, strictmatch=False):
         # Returns a proper pair for corpus matching. If seed is only one word,
         # returns a list of pairs starting with the word, case insensitive.
+        # Lookups go through the word indexes instead of scanning every key in the chain.
+
+        text = ' '.join(seed)
+        if len(seed) >= 2 and strictmatch:  # TODO: have strictmatch actually togglable
+            if text in self.key_ids:
+                return text
+            return []
+        return [pair for _, pair in self.iter_pairs(seed, strictmatch)]
+
+    def iter_pairs(self, seed, strictmatch=False, start=0) -> Iterator[tuple[int, str]]:
+        """Lazily yield the (key id, pair) of each pair that get_pairs() would return, in order.
 
+        Only pairs with a key id of at least start are yielded, so a search can be resumed after
+        the last key id seen."""
         text = ' '.join(seed)
-        flags = 0
-        regex = r""
         if len(seed) >= 2:
-            if strictmatch:  # TODO: have strictmatch actually togglable
-                if text in self.chain:
-                    return text
-                return []
-            else:
-                possiblepairs = []
-                # remove punctuation from seed
-                cleanedseed = re.search(r"\b(\w+)\b.+\b(\w+)\b", text).groups()
-                flags = re.IGNORECASE
-                regex = fr"\b{cleanedseed[0]}\b.+\b{cleanedseed[1]}\b"
-            for pair in self.chain:
-                if re.search(regex, pair, flags=flags) is not None:
-                    possiblepairs.append(pair)
-            return possiblepairs
+            # remove punctuation from seed: use its first and last words
+            words = WORD.findall(text.lower())
+            if len(words) < 2:
+                return
+            first, last = words[0], words[-1]
+            candidates = self.word_index.get(last, ())
+            firsts = self.word_index.get(first, ())
+            for key in firsts[bisect_left(firsts, start):]:
+                # both posting lists are sorted, so membership is a binary search
+                found = bisect_left(candidates, key)
+                if found < len(candidates) and candidates[found] == key:
+                    # the last word must also appear somewhere after the first one
+                    pair = self.keys[key]
+                    pairwords = WORD.findall(pair.lower())
+                    if last in pairwords[pairwords.index(first) + 1:]:
+                        yield key, pair
+        elif WORD.fullmatch(text) is None:
+            # not a plain word, so the index can't answer this; match it literally
+            flags = 0 if strictmatch else re.IGNORECASE
+            regex = re.compile(fr"^\W*\b{re.escape(text)}\b", flags=flags)
+            for key in range(start, len(self.keys)):
+                if regex.search(self.keys[key]) is not None:
+                    yield key, self.keys[key]
         else:
-            possiblepairs = []
-            if not strictmatch:
-                flags = re.IGNORECASE
-            regex = fr"^\W*\b{text}\b"
-            for pair in self.chain:
-                if re.search(regex, pair, flags=flags) is not None:
-                    possiblepairs.append(pair)
-            return possiblepairs
+            keys = self.first_word_index.get(text.lower(), ())
+            for key in keys[bisect_left(keys, start):]:
+                pair = self.keys[key]
+                if not strictmatch or WORD.search(pair).group() == text:
+                    yield key, pair
+
+    def _index_pairs(self):
+        # Build the word indexes used by get_pairs from the chain keys.
+        word_index = {}
+        first_word_index = {}
+        for key, pair in enumerate(self.keys):
+            words = WORD.findall(pair.lower())
+            if not words:
+                continue
+            for word in dict.fromkeys(words):  # unique words, in order
+                word_index.setdefault(word, []).append(key)
+            first_word_index.setdefault(words[0], []).append(key)
+        self.word_index = WordIndex.from_lists(word_index)
+        self.first_word_index = WordIndex.from_lists(first_word_index)
 
     def generate_sentence(self, seed="") -> str:
         """Generate a single sentence. First two words are seeded/randomly picked."""
-        if len(seed) == 0 or seed.isspace():
-            seed = self.openingwords[random.randint(0, len(self.openingwords))]
-        words = []
-
-        # manual seeding: allow number of words up to self.order
-        words.extend(seed.split(' ')[:self.order])
-        for i in range(0, 100):
-            text = words[i]
-            for j in range(1, self.order):
-                text = f"{text} {words[i+j]}"
-                text2 = self.chain[text][random.randint(0, len(self.chain[text])-1)]
+        return self.generate_sentences(1, seed)[0]
+
+    def generate_sentences(self, count: int, seed="", skip_dead_ends: bool = False) -> list[str]:
+        """Generate count sentences in one call, all from the same seed, or each from random
+        opening words if there is no seed.
+
+        A sentence that runs into a key with no successors raises KeyError, or with
+        skip_dead_ends is left out, so that fewer than count sentences may be returned."""
+        # look everything up once for the whole batch
+        rand = random.random
+        offsets, probability, alias = self.offsets, self.probability, self.alias
+        successors, next_keys, vocabulary = self.successors, self.next_keys, self.vocabulary
+        sentences = []
+        for _ in range(count):
+            if len(seed) == 0 or seed.isspace():
+                opening = random.choice(self.openingwords)
+            else:
+                opening = seed
+            # manual seeding: allow number of words up to self.order
+            words = opening.split(' ')[:self.order]
+            next_key = self.key_ids[' '.join(words)]
+            for i in range(0, 100):
+                if next_key < 0:
+                    if skip_dead_ends:
+                        break
+                    raise KeyError(' '.join(words[-self.order:]))
+                key = next_key
+                # pick a successor from the alias table: a uniformly random column, then either
+                # that column's own successor or its alias
+                start = offsets[key]
+                successor = start + int(rand() * (offsets[key + 1] - start))
+                if rand() >= probability[successor]:
+                    successor = alias[successor]
+                text2 = vocabulary[successors[successor]]
                 # Inserts a randomly generated location hint for Isner.
-                if text2 == "#MAKESECRET#":
+                if text2 == SECRET:
                     text2 = self._make_secret()
                 words.append(text2)
                 if '.' in text2:
-                    return ' '.join(words)
-        return text
+                    sentences.append(' '.join(words))
+                    break
+                next_key = next_keys[successor]
+            else:
+                sentences.append(self.keys[key])
+        return sentences
 
-    def _append_secret(self):
+    @staticmethod
+    def _append_secret(chain: dict[str: Counter]):
         # Add additional keys to the corpus to add a chance for a secret
         # try "?sleeptalk isner test" to guarantee secret generation.
         keys = ["of the", "to the", "in the", "with the", "isner test"]
 
         for key in keys:
-            if key in self.chain:
-                self.chain[key].append("#MAKESECRET#")
-            else:
-                self.chain[key] = ["#MAKESECRET#"]
+            chain.setdefault(key, Counter())[SECRET] += 1
 
     def _make_secret(self) -> str:
         possiblelocations = ["Golgotha", "Grit Gate",
@@ -121,23 +270,263 @@ class Corpus:
 
         return f"{str1}, {str2}."
 
+    def load(self, json_path: Path, compiled_path: Path):
+        """Load the corpus from the compiled file if it was built from the current JSON corpus.
+        Otherwise load the JSON corpus and write a new compiled file for next time."""
+        started = time.perf_counter()
+        raw = json_path.read_bytes()
+        digest = hashlib.sha256(raw).hexdigest()
+        try:
+            if self.load_compiled(compiled_path, digest):
+                log.info(f'Loaded compiled corpus: {len(self.keys)} keys,'
+                         f' {len(self.successors)} successors, {len(self.vocabulary)} words'
+                         f' in {(time.perf_counter() - started) * 1000:.0f} ms')
+                return
+            log.info(f'{compiled_path} is missing or out of date, compiling the corpus.')
+        except (OSError, ValueError, KeyError, struct.error) as e:
+            log.warning(f'Could not read the compiled corpus {compiled_path}, recompiling: {e}')
+        self._load_data(json.loads(raw))
+        log.info(f'Loaded corpus: {len(self.keys)} keys, {len(self.successors)} successors,'
+                 f' {len(self.vocabulary)} words in {time.perf_counter() - started:.2f} s')
+        try:
+            self.save_compiled(compiled_path, digest)
+        except OSError as e:
+            log.warning(f'Could not write the compiled corpus {compiled_path}: {e}')
+
     def load_json(self, path):
         with open(path, encoding='utf-8') as json_file:
             data = json.load(json_file)
+        self._load_data(data)
+        return data
+
+    def _load_data(self, data: dict):
+        # key -> how many times each successor appears, in the order they first appear
+        chain: dict[str: Counter] = {}
         for key, values in zip(data["keys"], data["values"]):
             if len(values):  # guard against buggy key:value pairs with "" as the value
-                splitvalues = values.split('\u0001')
-                if key in self.chain:
-                    for value in splitvalues:
-                        if value not in self.chain[key]:
-                            self.chain[key].append(value)
-                else:
-                    self.chain[key] = splitvalues
+                chain.setdefault(key, Counter()).update(values.split('\u0001'))
+        self._append_secret(chain)
+        self._compile(chain)
         self.order = data["order"]
         self.openingwords = data["OpeningWords"]
-        self._append_secret()
-        return data
+        self._index_pairs()
+
+    def save_compiled(self, path: Path, source: str):
+        """Write the loaded corpus to a compiled file. source is the hash of the JSON corpus it
+        was loaded from."""
+        sections = {
+            'vocabulary': SEPARATOR.join(self.vocabulary).encode('utf-8'),
+            'keys': SEPARATOR.join(self.keys).encode('utf-8'),
+            'offsets': self.offsets.tobytes(),
+            'successors': self.successors.tobytes(),
+            'next_keys': self.next_keys.tobytes(),
+            'probability': self.probability.tobytes(),
+            'alias': self.alias.tobytes(),
+        }
+        for name, index in (('word_index', self.word_index),
+                            ('first_word_index', self.first_word_index)):
+            sections[f'{name}.words'] = SEPARATOR.join(index.words).encode('utf-8')
+            sections[f'{name}.offsets'] = index.offsets.tobytes()
+            sections[f'{name}.postings'] = index.postings.tobytes()
+        bounds = {}
+        position = 0
+        for name, section in sections.items():
+            bounds[name] = [position, position + len(section)]
+            position += len(section)
+        header = json.dumps({'source': source, 'byteorder': sys.byteorder, 'order': self.order,
+                             'OpeningWords': self.openingwords,
+                             'sections': bounds}).encode('utf-8')
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_suffix(path.suffix + '.tmp')
+        with open(tmp_path, 'wb') as f:
+            f.write(HEADER.pack(MAGIC, len(header)))
+            f.write(header)
+            for section in sections.values():
+                f.write(section)
+        tmp_path.replace(path)
+        log.info(f'Wrote compiled corpus to {path} ({HEADER.size + len(header) + position} bytes)')
+
+    def load_compiled(self, path: Path, source: str) -> bool:
+        """Load a compiled file written by save_compiled(). Returns False without loading anything
+        if there is none, or if it was compiled from a different JSON corpus."""
+        if not path.exists():
+            return False
+        data = memoryview(path.read_bytes())
+        magic, header_len = HEADER.unpack_from(data)
+        if magic != MAGIC:
+            return False  # written by an older version of the bot
+        header = json.loads(bytes(data[HEADER.size:HEADER.size + header_len]))
+        if header['source'] != source or header['byteorder'] != sys.byteorder:
+            return False
+        body = data[HEADER.size + header_len:]
+
+        def section(name: str, typecode: str = None):
+            start, end = header['sections'][name]
+            if typecode is not None:
+                values = array(typecode)
+                values.frombytes(body[start:end])
+                return values
+            text = str(body[start:end], 'utf-8')
+            return text.split(SEPARATOR) if text else []
+
+        self.vocabulary = section('vocabulary')
+        self.keys = section('keys')
+        self.key_ids = {pair: key for key, pair in enumerate(self.keys)}
+        self.offsets = section('offsets', 'I')
+        self.successors = section('successors', 'I')
+        self.next_keys = section('next_keys', 'i')
+        self.probability = section('probability', 'd')
+        self.alias = section('alias', 'I')
+        self.word_index, self.first_word_index = (
+            WordIndex(section(f'{name}.words'), section(f'{name}.offsets', 'I'),
+                      section(f'{name}.postings', 'I'))
+            for name in ('word_index', 'first_word_index'))
+        self.order = header['order']
+        self.openingwords = header['OpeningWords']
+        return True
+
+    def _compile(self, chain: dict[str: Counter]):
+        # Encode a {key: {successor: count}} chain into the integer tables described in __init__.
+        self.keys = list(chain)
+        self.key_ids = {pair: key for key, pair in enumerate(self.keys)}
+        self.vocabulary = list(dict.fromkeys(value for values in chain.values()
+                                             for value in values))
+        token_ids = {value: token for token, value in enumerate(self.vocabulary)}
+        self.successors = array('I', [token_ids[value]
+                                      for values in chain.values() for value in values])
+        # the key a successor leads to is the current key minus its first word, plus the successor
+        self.next_keys = array('i', [self.key_ids.get(prefix + value, -1)
+                                     for pair, values in chain.items()
+                                     for prefix in [pair.split(' ', 1)[-1] + ' ']
+                                     for value in values])
+        self.offsets = array('I', [0])
+        self.offsets.extend(accumulate(len(values) for values in chain.values()))
+        self.probability = array('d')
+        self.alias = array('I')
+        for start, values in zip(self.offsets, chain.values()):
+            probability, alias = alias_table(list(values.values()))
+            self.probability.extend(probability)
+            self.alias.extend(start + column for column in alias)
+
+
+class WordIndex:
+    """Maps words to the ids of the chain keys they appear in, in ascending order.
+
+    The id lists of all the words are stored back to back in one flat array, so that the index can
+    be saved and loaded as a few arrays rather than a dict of lists."""
+
+    def __init__(self, words: list[str], offsets: array, postings: array):
+        self.words = words
+        self.offsets = offsets
+        self.postings = postings
+        self._rows = {word: row for row, word in enumerate(words)}
+        self._view = memoryview(postings)
+
+    @classmethod
+    def from_lists(cls, lists: dict[str: list[int]]) -> 'WordIndex':
+        offsets = array('I', [0])
+        offsets.extend(accumulate(len(keys) for keys in lists.values()))
+        return cls(list(lists), offsets,
+                   array('I', [key for keys in lists.values() for key in keys]))
+
+    def get(self, word: str, default=()):
+        """Return the ids of the chain keys containing word, or default if there are none."""
+        row = self._rows.get(word)
+        if row is None:
+            return default
+        return self._view[self.offsets[row]:self.offsets[row + 1]]
+
+
+class SentencePool:
+    """A bounded pool of pre-generated unseeded sentences.
+
+    Unseeded requests take a ready sentence from the pool instead of walking the chain on the
+    event loop. A background task started with start() tops the pool back up after it is used,
+    a few sentences at a time so that it yields to other tasks in between. Seeded sentences are
+    still generated on demand with Corpus.generate_sentence()."""
+
+    def __init__(self, corpus: Corpus, size: int = POOL_SIZE, batch: int = POOL_BATCH):
+        self.corpus = corpus
+        self.size = size
+        self.batch = batch
+        self.hits = 0
+        self.misses = 0
+        self.generated = 0
+        self.generating_time = 0.0
+        self._sentences: deque[str] = deque()
+        self._wanted = asyncio.Event()
+        self._wanted.set()  # fill the pool as soon as the task starts
+        self._task = None
+
+    def __len__(self):
+        return len(self._sentences)
+
+    def get(self) -> str:
+        """Return an unseeded sentence, from the pool if it has one ready."""
+        try:
+            sentence = self._sentences.popleft()
+            self.hits += 1
+        except IndexError:
+            sentence = self.corpus.generate_sentence()
+            self.misses += 1
+        self._wanted.set()
+        return sentence
+
+    def start(self, loop: asyncio.AbstractEventLoop):
+        """Start the background task that keeps the pool full, unless it is already running."""
+        if self._task is None:
+            self._task = loop.create_task(self._refill_forever())
+
+    async def fill(self) -> int:
+        """Generate sentences until the pool is full. Returns how many were added."""
+        added = 0
+        failures = 0  # batches in a row without a single sentence
+        while len(self._sentences) < self.size:
+            started = time.perf_counter()
+            try:
+                # sentences that run into a dead end are left out, and the rest kept
+                sentences = self.corpus.generate_sentences(
+                    min(self.batch, self.size - len(self._sentences)), skip_dead_ends=True)
+            except KeyError:  # opening words that aren't a key
+                sentences = []
+            self.generating_time += time.perf_counter() - started
+            self._sentences.extend(sentences)
+            added += len(sentences)
+            failures = 0 if sentences else failures + 1
+            if failures >= POOL_MAX_FAILURES:
+                log.warning(f'Sentence pool: {failures} batches in a row ran into dead ends,'
+                            f' giving up until the pool is next used')
+                break
+            # let anything else that is waiting run between batches, and back off while the chain
+            # keeps running into dead ends
+            await asyncio.sleep(POOL_RETRY_DELAY * failures)
+        self.generated += added
+        return added
+
+    async def _refill_forever(self):
+        while True:
+            await self._wanted.wait()
+            self._wanted.clear()
+            started = time.perf_counter()
+            added = await self.fill()
+            if added:
+                log.debug(f'Added {added} sentences to the pool in'
+                          f' {(time.perf_counter() - started) * 1000:.0f} ms; {self.stats()}')
+
+    def stats(self) -> dict:
+        """Return the pool metrics as a dictionary. refill_rate is in sentences per second of
+        generating time."""
+        requests = self.hits + self.misses
+        return {
+            'ready': len(self._sentences),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / requests if requests else 0.0,
+            'generated': self.generated,
+            'refill_rate': self.generated / self.generating_time if self.generating_time else 0.0,
+        }
 
 
-# Single instance for export
+# Single instances for export
 corpus = Corpus()
+sentence_pool = SentencePool(corpus)
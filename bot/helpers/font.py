@@ -1,10 +1,16 @@
 ﻿import importlib.resources
+import io
+import math
+import time
+from functools import lru_cache
 from textwrap import TextWrapper
+from typing import Optional
 
 from hagadias import constants
-from hagadias.helpers import iter_qud_colors, strip_newstyle_qud_colors
+from hagadias.helpers import iter_qud_colors, parse_qud_colors, strip_newstyle_qud_colors
 from PIL import Image, ImageFont, ImageDraw
 
+from bot.helpers.cache import LRUCache
 from bot.shared import gameroot
 game_colors = gameroot.get_colors()
 
@@ -23,6 +29,23 @@ PAD = 10
 innerpad = (CHARSIZE[0] * 2, CHARSIZE[1] * 2)
 ABSINNERPAD = (innerpad[0] + PAD, innerpad[1] + PAD)
 POPUPCLASSIC, DIALOGUECLASSIC = 1, 2
+# text measurements that never change, so they are taken once
+PRESS_SPACE_BBOX = FONT.getbbox('[press space]')
+PRESS_BBOX = FONT.getbbox('[press ')
+OPEN_BRACKET_BBOX = FONT.getbbox('[ ')
+# conversations (several message boxes in one attachment)
+MAX_PANELS = 8
+CONVERSATION_GAP = PAD  # space between stacked message boxes
+MAX_TYPEWRITER_FRAMES = 60
+TYPEWRITER_FRAME_MS = 40
+TYPEWRITER_HOLD_MS = 2000  # how long the last frame of each message box stays up
+# message boxes come in a small set of sizes on the CHARSIZE grid, so the border and scanline
+# layers are drawn once per size and reused. Bounds the number of sizes kept per layer, and their
+# total size (a long dialogue title makes a very wide box):
+LAYER_CACHE_SIZE = 128
+LAYER_CACHE_BYTES = 64 * 1024 * 1024
+# color code (or None for uncolored text) to RGB color
+QUD_COLORS_OR_WHITE = {None: QUD_WHITE, **constants.QUD_COLORS}
 
 
 class DrawException(Exception):
@@ -31,22 +54,71 @@ class DrawException(Exception):
         self.message = message
 
 
+class GlyphAtlas:
+    """Rasterizes each glyph of a font once, as an alpha mask, and blits it in any color.
+
+    The masks come from the same FreeType call that ImageDraw.text makes, keyed by the fractional
+    part of the draw position, and are pasted through the same fill-with-mask operation, so the
+    output is pixel-identical to calling draw.text one character at a time."""
+
+    def __init__(self, font: ImageFont.FreeTypeFont, max_glyphs: int = 4096):
+        self.font = font
+        self.glyphs = LRUCache(max_entries=max_glyphs)
+
+    def glyph(self, char: str, start: tuple) -> tuple:
+        """Return the (mask, offset) for a character rasterized at a fractional start position."""
+        key = (char, start)
+        glyph = self.glyphs.get(key)
+        if glyph is None:
+            mask, offset = self.font.getmask2(char, 'L', start=start)
+            # copy the raw core image into a public Image once, for paste()
+            glyph = (Image.frombytes('L', mask.size, bytes(mask)), offset)
+            self.glyphs.put(key, glyph)
+        return glyph
+
+    def draw(self, image: Image, xy: tuple, char: str, color):
+        """Draw a single character onto an image, like draw.text(xy, char, font, fill=color)."""
+        x, y = xy
+        mask, offset = self.glyph(char, (math.modf(x)[0], math.modf(y)[0]))
+        left = int(x) + offset[0]
+        top = int(y) + offset[1]
+        image.paste(color, (left, top, left + mask.width, top + mask.height), mask)
+
+
+GLYPHS = GlyphAtlas(FONT)
+
+
 def drawttf(saying, bordertype='-popupclassic', dialog_title='') -> Image:
     """Main function for drawing the message box."""
+    border_kind, imgdim, dialog_title, glyphs = layoutttf(saying, bordertype, dialog_title)
+    # create and draw image
+    image = drawborder(border_kind, imgdim, PAD, CHARSIZE, dialog_title)
+    for xy, char, color in glyphs:
+        GLYPHS.draw(image, xy, char, color)
+    # image post processing
+    image = drawscanline(image)
+    return image
+
+
+def layoutttf(saying, bordertype='-popupclassic', dialog_title='') -> tuple:
+    """Work out the size of the message box, and where and in which color to draw each character.
+
+    Takes the same arguments as drawttf. Returns a tuple of the border kind, the image dimensions,
+    the dialog title, and a list of ((x, y), char, color) for each character to draw."""
     if dialog_title is None:
         dialog_title = ''
     if bordertype is None:
         bordertype = '-p'
-    # first, wrap and split the plaintext, then reassemble with colours
-    plain_saying = strip_newstyle_qud_colors(saying)
+    # first, parse the color markup once, and wrap and split the plaintext
+    segments = parse_qud_colors(saying)
+    plain_saying = ''.join(text for text, _ in segments)
     wrapper = TextWrapper(width=MAXW, max_lines=MAXH, replace_whitespace=False)
     paragraphs = plain_saying.split('\n')
     text_lines = []
     for paragraph in paragraphs:
         text_lines.extend(wrapper.fill(paragraph).split('\n'))
     # we will use the plain text wrapped by TextWrapper to count real characters on each line,
-    # then draw those characters using the parsed-out per-character color codes:
-    plain_text_for_sizing = '\n'.join(text_lines)
+    # then draw those characters using the parsed-out per-character color codes.
     # Since we always use a monospaced font we can calulate the text width and height
     sayingx = CHARSIZE[0] * max(list(map(lambda line: len(line), text_lines)))
     sayingy = CHARSIZE[1] * len(text_lines)
@@ -61,10 +133,6 @@ def drawttf(saying, bordertype='-popupclassic', dialog_title='') -> Image:
     pad_pxwidth = pxwidth + (2 * ABSINNERPAD[0])
     pad_pxheight = sayingy + (2 * ABSINNERPAD[1])
     imgdim = (pad_pxwidth, pad_pxheight)
-    # create and draw image
-    image = Image.new(mode='RGBA', size=imgdim, color=QUD_VIRIDIAN)
-    draw = ImageDraw.Draw(image)
-    drawborder(border_kind, draw, imgdim, PAD, CHARSIZE, dialog_title)
     if border_kind == POPUPCLASSIC:
         leftx = (imgdim[0] - text_pxwidth) / 2  # center text if popup
     else:
@@ -73,35 +141,208 @@ def drawttf(saying, bordertype='-popupclassic', dialog_title='') -> Image:
         leftx = ABSINNERPAD[0]
     cur_x = leftx
     cur_y = ABSINNERPAD[1] - 4
-    chars_colors = iter_qud_colors(saying, game_colors)
+    # walk the colored characters alongside the wrapped lines, in a single pass
+    chars_colors = colorchars(segments)
+    glyphs = []
+    pos = 0
     for line in text_lines:
-        for tracking, (char, code) in zip(line, chars_colors):
+        for tracking in line:
+            if pos == len(chars_colors):
+                break
+            char, code = chars_colors[pos]
+            pos += 1
             # fast-forward if necessary to skip whitespace that was deleted by TextWrapper
-            while char != tracking:
-                try:
-                    char, code = next(chars_colors)
-                except StopIteration:
-                    break
-            if code is None:
-                color = constants.QUD_COLORS['y']
-            else:
-                color = constants.QUD_COLORS[code]
-            draw.text((cur_x, cur_y), char, font=FONT, fill=color)
+            while char != tracking and pos < len(chars_colors):
+                char, code = chars_colors[pos]
+                pos += 1
+            glyphs.append(((cur_x, cur_y), char, QUD_COLORS_OR_WHITE[code]))
             cur_x += CHARSIZE[0]
         cur_x = leftx
         cur_y += CHARSIZE[1]
-    # image post processing
-    image = drawscanline(image)
-    return image
+    return border_kind, imgdim, dialog_title, glyphs
+
+
+def drawttf_png(saying, bordertype='-popupclassic', dialog_title='') -> io.BytesIO:
+    """Draw the message box and encode it as PNG. Takes the same arguments as drawttf."""
+    image = drawttf(saying, bordertype, dialog_title)
+    png_b = io.BytesIO()
+    image.save(png_b, format='png')
+    png_b.seek(0)
+    return png_b
+
+
+def colorchars(segments) -> list:
+    """Expand (text, shader) segments from parse_qud_colors into a list of (char, color code),
+    like iter_qud_colors does."""
+    chars_colors = []
+    for text, code in segments:
+        chars_colors.extend(zip(text, shadercolors(code, len(text))))
+    return chars_colors
+
+
+def shadercolors(code, length) -> tuple:
+    """Return the color code of each character of a text segment of the given length colored with
+    a shader, as iter_qud_colors would. Expansions of deterministic shaders are memoized.
+
+    May return fewer colors than length, if the shader is unknown."""
+    if code is None:
+        return (None,) * length
+    if israndomshader(code):
+        return expandshader(code, length)  # randomized, so can't be reused
+    return cachedexpandshader(code, length)
+
+
+def israndomshader(code) -> bool:
+    """Whether a shader colors its text differently every time it is applied."""
+    return code is not None and (code in ('chaotic', 'random') or code.endswith(' distribution')
+                                 or game_colors['shaders'].get(code, {}).get('type')
+                                 == 'distribution')
+
+
+def expandshader(code, length) -> tuple:
+    # the shader name can't contain '|', so this always parses back to exactly one segment
+    return tuple(color for _, color in iter_qud_colors(f'{{{{{code}|{"x" * length}}}}}',
+                                                       game_colors))
+
+
+cachedexpandshader = lru_cache(maxsize=1024)(expandshader)
+
+
+def drawconversation(panels, deadline=None) -> Image:
+    """Draw several message boxes stacked on top of each other in a single image.
+
+    Args:
+        panels: list of (saying, bordertype, dialog_title) tuples, as taken by drawttf
+        deadline: time.perf_counter() value by which drawing must be done, or None for no limit
+    """
+    checkpanels(panels)
+    images = []
+    for panel in panels:
+        checkdeadline(deadline)
+        images.append(drawttf(*panel))
+    width = max(image.width for image in images)
+    height = sum(image.height for image in images) + CONVERSATION_GAP * (len(images) - 1)
+    conversation = Image.new(mode='RGBA', size=(width, height), color=QUD_VIRIDIAN)
+    cur_y = 0
+    for image in images:
+        conversation.paste(image, (0, cur_y))
+        cur_y += image.height + CONVERSATION_GAP
+    return conversation
+
+
+def drawtypewriter(panels, deadline=None) -> tuple:
+    """Draw several message boxes one after the other as typewriter animation frames.
+
+    Every frame is drawn by adding the next few characters to the previous frame, rather than
+    drawing it from scratch. Returns a tuple of the list of frames and their durations in ms.
+
+    Args:
+        panels: list of (saying, bordertype, dialog_title) tuples, as taken by drawttf
+        deadline: time.perf_counter() value by which drawing must be done, or None for no limit
+    """
+    checkpanels(panels)
+    layouts = [layoutttf(*panel) for panel in panels]
+    size = (max(imgdim[0] for _, imgdim, _, _ in layouts),
+            max(imgdim[1] for _, imgdim, _, _ in layouts))
+    total_chars = sum(len(glyphs) for _, _, _, glyphs in layouts)
+    step = max(1, math.ceil(total_chars / (MAX_TYPEWRITER_FRAMES - len(layouts))))
+    frame = Image.new(mode='RGBA', size=size, color=QUD_VIRIDIAN)
+    frames, durations = [], []
+
+    def addframe():
+        checkdeadline(deadline)
+        frames.append(drawscanline(frame).convert('P', palette=Image.Palette.ADAPTIVE))
+        durations.append(TYPEWRITER_FRAME_MS)
+
+    for border_kind, imgdim, dialog_title, glyphs in layouts:
+        frame.paste(QUD_VIRIDIAN, (0, 0, size[0], size[1]))
+        frame.paste(drawborder(border_kind, imgdim, PAD, CHARSIZE, dialog_title), (0, 0))
+        for i, (xy, char, color) in enumerate(glyphs, start=1):
+            GLYPHS.draw(frame, xy, char, color)
+            if i % step == 0:
+                addframe()
+        if len(glyphs) % step != 0 or len(glyphs) == 0:
+            addframe()  # the message box is complete
+        durations[-1] = TYPEWRITER_HOLD_MS
+    return frames, durations
+
+
+def drawconversation_png(panels, deadline=None) -> io.BytesIO:
+    """Draw a stacked conversation and encode it as PNG. See drawconversation."""
+    image = drawconversation(panels, deadline)
+    png_b = io.BytesIO()
+    image.save(png_b, format='png')
+    png_b.seek(0)
+    return png_b
+
+
+def drawtypewriter_gif(panels, deadline=None) -> io.BytesIO:
+    """Draw a typewriter animation of a conversation and encode it as GIF. See drawtypewriter."""
+    frames, durations = drawtypewriter(panels, deadline)
+    gif_b = io.BytesIO()
+    frames[0].save(gif_b, format='gif', save_all=True, append_images=frames[1:],
+                   duration=durations, loop=0)
+    gif_b.seek(0)
+    return gif_b
+
+
+def checkpanels(panels):
+    if len(panels) == 0:
+        raise DrawException("There was nothing to draw.")
+    if len(panels) > MAX_PANELS:
+        raise DrawException(f"That's too many message boxes! The limit is {MAX_PANELS}.")
+
+
+def checkdeadline(deadline):
+    if deadline is not None and time.perf_counter() > deadline:
+        raise DrawException("That took too long to draw.")
+
+
+def drawttf_key(saying, bordertype='-popupclassic', dialog_title='') -> Optional[tuple]:
+    """Return a key for the image drawttf would draw: equal keys always draw identical images.
+    Returns None if the markup uses a randomized shader, since then no two drawings are alike.
+
+    Takes the same arguments as drawttf, and the key is itself a valid set of drawttf arguments
+    (with the border type and title normalized). The text is kept as it is: wrapping depends on
+    its exact whitespace, and its case is drawn as given, so any normalization would change the
+    image."""
+    border_kind = determineborder('-p' if bordertype is None else bordertype)
+    if border_kind == POPUPCLASSIC:
+        key = saying, '-p', ''  # popups don't show a title
+    else:
+        key = saying, '-d', '' if dialog_title is None else dialog_title
+    if any(israndomshader(code) for text in (key[0], key[2])
+           for _, code in parse_qud_colors(text)):
+        return None
+    return key
 
 
 def drawscanline(image: Image) -> Image:
     """Draw scanlines over top of an image."""
-    lines = Image.new(mode='RGBA', size=image.size, color=(255, 255, 255, 0))
+    return Image.alpha_composite(image, scanlinelayer(image.size))
+
+
+def image_bytes(image: Image) -> int:
+    return image.width * image.height * len(image.getbands())
+
+
+scanline_layers = LRUCache(max_entries=LAYER_CACHE_SIZE, max_bytes=LAYER_CACHE_BYTES,
+                           sizeof=image_bytes)
+border_templates = LRUCache(max_entries=LAYER_CACHE_SIZE, max_bytes=LAYER_CACHE_BYTES,
+                            sizeof=image_bytes)
+
+
+def scanlinelayer(size) -> Image:
+    """Transparent layer with the scanlines for an image size. Cached, so don't modify it."""
+    lines = scanline_layers.get(size)
+    if lines is not None:
+        return lines
+    lines = Image.new(mode='RGBA', size=size, color=(255, 255, 255, 0))
     linedraw = ImageDraw.Draw(lines)
-    for i in range(0, int(image.size[1] / 6)):
-        linedraw.line([(0, i * 6), (image.size[0] - 1, i * 6)], fill=(0, 0, 0, 16), width=3)
-    return Image.alpha_composite(image, lines)
+    for i in range(0, int(size[1] / 6)):
+        linedraw.line([(0, i * 6), (size[0] - 1, i * 6)], fill=(0, 0, 0, 16), width=3)
+    scanline_layers.put(size, lines)
+    return lines
 
 
 def determineborder(kind):
@@ -113,14 +354,30 @@ def determineborder(kind):
         raise DrawException("There was no border of that type.")
 
 
-def drawborder(kind, draw, imgdim, padding, charsize, title):
-    """Draw the border over an image. Accepts multiple border types."""
+def drawborder(kind, imgdim, padding, charsize, title) -> Image:
+    """Create a new image with the border drawn. Accepts multiple border types."""
+    image = bordertemplate(kind, imgdim, padding, charsize).copy()
+    if kind == DIALOGUECLASSIC:
+        drawdialoguetitle(image, padding, charsize, title)
+    return image
+
+
+def bordertemplate(kind, imgdim, padding, charsize) -> Image:
+    """Blank message box with only its border drawn. Cached, so copy it before drawing on it."""
+    key = (kind, imgdim, padding, charsize)
+    image = border_templates.get(key)
+    if image is not None:
+        return image
+    image = Image.new(mode='RGBA', size=imgdim, color=QUD_VIRIDIAN)
+    draw = ImageDraw.Draw(image)
     if kind == POPUPCLASSIC:
-        return drawpopupclassic(draw, imgdim, padding, charsize)
+        drawpopupclassic(draw, imgdim, padding, charsize)
     elif kind == DIALOGUECLASSIC:
-        return drawdialogueclassic(draw, imgdim, padding, charsize, title)
+        drawdialogueclassic(draw, imgdim, padding, charsize)
     else:
         raise DrawException("There was no border of that type.")
+    border_templates.put(key, image)
+    return image
 
 
 def drawpopupclassic(draw, imgdim, padding, charsize):
@@ -151,23 +408,28 @@ def drawpopupclassic(draw, imgdim, padding, charsize):
                    fill='#b1c9c3')
 
     # draw "press space"
-    text1 = '[press space]'
-    text1dim = FONT.getbbox(text1)
+    text1dim = PRESS_SPACE_BBOX
     draw.rectangle([((imgdim[0] - text1dim[2]) / 2 - 1, imgdim[1] - padding - charsize[1]),
                     ((imgdim[0] + text1dim[2]) / 2 + 1, imgdim[1])],
                    fill='#0f3b3a')
     draw.multiline_text(((imgdim[0] - text1dim[2]) / 2, imgdim[1] - padding - charsize[1] - 5),
                         '[press      ]', font=FONT, fill='#b1c9c3')
-    draw.multiline_text(((imgdim[0] - text1dim[2]) / 2 + FONT.getbbox('[press ')[2],
+    draw.multiline_text(((imgdim[0] - text1dim[2]) / 2 + PRESS_BBOX[2],
                          imgdim[1] - padding - charsize[1] - 5), 'space', font=FONT, fill='#cfc041')
     return draw
 
 
-def drawdialogueclassic(draw, imgdim, padding, charsize, title):
+def drawdialogueclassic(draw, imgdim, padding, charsize):
     """Draw classic dialogue border."""
     draw.rectangle([(padding + 1, padding + charsize[0] / 2),
                     (imgdim[0] - padding - 2, imgdim[1] - padding - 1)], outline=QUD_WHITE, width=4)
-    # draw person speaking. If title isn't specified, don't draw
+    return draw
+
+
+def drawdialoguetitle(image, padding, charsize, title):
+    """Draw the person speaking over a classic dialogue border."""
+    draw = ImageDraw.Draw(image)
+    # If title isn't specified, don't draw
     if title is not None and title != '':
         plain_title = strip_newstyle_qud_colors(title)
         textdim = FONT.getbbox(f'[ {plain_title} ]')
@@ -176,17 +438,13 @@ def drawdialogueclassic(draw, imgdim, padding, charsize, title):
                        fill=QUD_VIRIDIAN)
         draw.text((charsize[0] * 2 + padding, 0), '[', font=FONT, fill=QUD_WHITE)
         draw.text((charsize[0] + padding + textdim[2], 0), ']', font=FONT, fill=QUD_WHITE)
-        cur_x = charsize[0] * 2 + padding + FONT.getbbox('[ ')[2]
+        cur_x = charsize[0] * 2 + padding + OPEN_BRACKET_BBOX[2]
         if plain_title != title:
-            for char, code in iter_qud_colors(title, game_colors):
-                if code is None:
-                    color = constants.QUD_COLORS['y']
-                else:
-                    color = constants.QUD_COLORS[code]
-                draw.text((cur_x, 0), char, font=FONT, fill=color)
+            for char, code in colorchars(parse_qud_colors(title)):
+                GLYPHS.draw(image, (cur_x, 0), char, QUD_COLORS_OR_WHITE[code])
                 cur_x += charsize[0]
         else:
             # didn't use any color shaders
-            draw.text((charsize[0] * 2 + padding + FONT.getbbox('[ ')[2], 0),
+            draw.text((charsize[0] * 2 + padding + OPEN_BRACKET_BBOX[2], 0),
                       title, font=FONT, fill=QUD_YELLOW)
     return draw
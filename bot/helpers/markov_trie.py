@@ -0,0 +1,130 @@
+"""A variable-order Markov model of the game's corpus, backed by a suffix trie.
+
+Corpus can only continue from exact chain keys, at the order the game exported
+LibraryCorpus.json with. SuffixTrie instead counts what follows every context of up to
+MAX_ORDER words. It generates from the longest context it has seen, backing off to shorter ones
+and, at worst, to the plain word frequencies. Any seed works, even one that isn't a chain key.
+
+The corpus only records what follows each key, so it can't teach contexts longer than its own
+order: with the game's order-2 corpus, orders 3 and 4 back off to order 2.
+
+Contexts are stored newest word first, so each trie node's children extend its context one word
+further into the past. Nodes are laid out breadth-first in flat arrays:
+    edge[n]             the word leading into node n from its parent (node 0 is the empty context)
+    first_child[n]      the children of node n are nodes first_child[n] to first_child[n + 1] - 1,
+                        sorted by edge, so a child is found with a binary search
+    offsets[n]          the successors of node n are tokens[offsets[n]:offsets[n + 1]], with
+                        their alias table in probability and alias
+"""
+import json
+import logging
+import random
+from array import array
+from bisect import bisect_left
+from collections import Counter
+from itertools import accumulate
+from pathlib import Path
+
+from bot.helpers.corpus import alias_table, JSON_PATH
+
+log = logging.getLogger('bot.' + __name__)
+
+MAX_ORDER = 4
+
+
+class SuffixTrie:
+    """Variable-order Markov model; see the module docstring."""
+
+    def __init__(self, data: dict, max_order: int = MAX_ORDER):
+        """Build the trie from the contents of LibraryCorpus.json."""
+        if not 1 <= max_order <= MAX_ORDER:
+            raise ValueError(f'max_order must be between 1 and {MAX_ORDER}')
+        self.max_order = max_order
+        self.openingwords = data["OpeningWords"]
+        self.vocabulary: list[str] = []
+        self.token_ids: dict[str: int] = {}
+        # context (token ids, newest first) -> successor token id -> count
+        contexts: dict[tuple: Counter] = {(): Counter()}
+        for key, values in zip(data["keys"], data["values"]):
+            if not len(values):  # guard against buggy key:value pairs with "" as the value
+                continue
+            history = tuple(self._token(word) for word in reversed(key.split(' ')))
+            successors = Counter(self._token(value) for value in values.split('\u0001'))
+            for length in range(min(max_order, len(history)) + 1):
+                contexts.setdefault(history[:length], Counter()).update(successors)
+        self._compile(contexts)
+
+    @classmethod
+    def from_json(cls, path: Path = JSON_PATH, max_order: int = MAX_ORDER) -> 'SuffixTrie':
+        with open(path, encoding='utf-8') as json_file:
+            return cls(json.load(json_file), max_order)
+
+    def _token(self, word: str) -> int:
+        token = self.token_ids.get(word)
+        if token is None:
+            token = self.token_ids[word] = len(self.vocabulary)
+            self.vocabulary.append(word)
+        return token
+
+    def _compile(self, contexts: dict[tuple: Counter]):
+        # sorting by length, then by the words themselves, puts the nodes in breadth-first order
+        # with each node's children together and sorted by edge
+        nodes = sorted(contexts, key=lambda context: (len(context), context))
+        self.edge = array('I', [context[-1] if context else 0 for context in nodes])
+        node_ids = {context: node for node, context in enumerate(nodes)}
+        children = [0] * len(nodes)
+        for context in nodes[1:]:
+            children[node_ids[context[:-1]]] += 1
+        self.first_child = array('I', accumulate(children, initial=1))
+        self.offsets = array('I', [0])
+        self.offsets.extend(accumulate(len(contexts[context]) for context in nodes))
+        self.tokens = array('I')
+        self.probability = array('d')
+        self.alias = array('I')
+        for start, context in zip(self.offsets, nodes):
+            successors = contexts[context]
+            self.tokens.extend(successors)
+            probability, alias = alias_table(list(successors.values()))
+            self.probability.extend(probability)
+            self.alias.extend(start + column for column in alias)
+        log.info(f'Built a suffix trie of order {self.max_order}: {len(nodes)} contexts,'
+                 f' {len(self.tokens)} successors, {len(self.vocabulary)} words')
+
+    def __len__(self):
+        return len(self.edge)
+
+    def context(self, history: list, order: int) -> int:
+        """Return the node of the longest known context of at most order words at the end of
+        history, a list of token ids (None for unknown words)."""
+        node = 0
+        for token in reversed(history[len(history) - order:]):
+            if token is None:
+                break
+            start, end = self.first_child[node], self.first_child[node + 1]
+            child = bisect_left(self.edge, token, start, end)
+            if child == end or self.edge[child] != token:
+                break
+            node = child
+        return node
+
+    def generate_sentence(self, seed: str = "", order: int = None) -> str:
+        """Generate a single sentence starting with the words of seed, or with random opening
+        words if there is no seed. Uses contexts of up to order words (max_order by default)."""
+        order = self.max_order if order is None else min(order, self.max_order)
+        if len(seed) == 0 or seed.isspace():
+            seed = random.choice(self.openingwords)
+        words = seed.split()
+        history = [self.token_ids.get(word) for word in words]
+        rand = random.random
+        for _ in range(100):
+            node = self.context(history, order)
+            start = self.offsets[node]
+            successor = start + int(rand() * (self.offsets[node + 1] - start))
+            if rand() >= self.probability[successor]:
+                successor = self.alias[successor]
+            token = self.tokens[successor]
+            words.append(self.vocabulary[token])
+            history.append(token)
+            if '.' in words[-1]:
+                break
+        return ' '.join(words)
@@ -3,11 +3,16 @@ Functionality for parsing a Caves of Qud build code into character attributes,
 and for building a printable character sheet based on the attributes.
 """
 
-from operator import add
+import base64
+import binascii
+import json
+import zlib
+from functools import lru_cache
 from typing import List
 
 from hagadias.qudtile import QudTile
 
+from bot.helpers.build_stats import Build
 from bot.shared import gameroot
 
 gamecodes = gameroot.get_character_codes()
@@ -15,61 +20,126 @@ gamecodes = gameroot.get_character_codes()
 ATTR_NAMES = ("Strength", "Agility", "Toughness", "Intelligence", "Willpower", "Ego")
 
 
+class BuildCodeError(Exception):
+    """Raised when a possible build code does not decode to one."""
+    pass
+
+
+def decode_build_code(code: str, max_size: int) -> dict:
+    """Decode a build code (a gzipped, base64-encoded JSON string) to its JSON data.
+
+    The gzip stream is decompressed incrementally and abandoned once it grows past max_size
+    bytes, so a small code that expands enormously can't exhaust memory. Raises BuildCodeError
+    with the reason if the code is not valid or too large."""
+    try:
+        compressed = base64.b64decode(code)
+    except binascii.Error as e:
+        raise BuildCodeError(f'not base64 ({e})')
+    decompressor = zlib.decompressobj(wbits=16 + zlib.MAX_WBITS)  # expect a gzip header
+    try:
+        data = decompressor.decompress(compressed, max_size + 1)
+    except zlib.error as e:
+        raise BuildCodeError(f'not gzip data ({e})')
+    if len(data) > max_size:
+        raise BuildCodeError(f'decompresses to more than {max_size} bytes')
+    if not decompressor.eof:
+        raise BuildCodeError('gzip data is truncated')
+    try:
+        return json.loads(data.decode(encoding='utf-8'))
+    except (UnicodeDecodeError, json.JSONDecodeError) as e:
+        raise BuildCodeError(f'not JSON ({e})')
+
+
 class Character:
     """Represents a Caves of Qud player character. This class is intended for modern build codes
     post 2.0.202 which are JSON strings, gzipped and base64-encoded.
     """
+    __slots__ = ('code', 'genotype', 'subtype', 'bonuses', 'selections', 'selection_noun',
+                 'attributes', 'name', 'pet', 'gender', 'pronounSet', 'startinglocation', '_tile')
 
     def __init__(self, code: dict):
         """Create a new character from a fully decoded build code."""
         self.code = code
+        self.name = None
+        self._tile = None
         for module in code['modules']:
-            match module['moduleType'].split(', '):
-                case ['XRL.CharacterBuilds.Qud.QudGenotypeModule', *_]:
-                    self.genotype = module['data']['Genotype']
-                case ['XRL.CharacterBuilds.Qud.QudSubtypeModule', *_]:
-                    self.subtype = module['data']['Subtype']
-                    self.bonuses = gamecodes['class_bonuses'][self.subtype]
-                case [('XRL.CharacterBuilds.Qud.QudMutationsModule' |
-                       'XRL.CharacterBuilds.Qud.QudCyberneticsModule'), *_]:
-                    self.selections = []
-                    self.selection_noun = 'Mutation' if 'Mutation' in module['moduleType']\
-                        else 'Cybernetic'
-                    for selection in module['data']['selections']:
-                        mod = selection[self.selection_noun]
-                        if selection['Count'] > 1:
-                            # Unstable Genome stack
-                            self.selections.append(mod + f' x{selection["Count"]}')
-                            continue
-                        if self.selection_noun == "Cybernetic" and mod is None:
-                            # True Kin with no implant - +1 toughness
-                            self.bonuses[2] += 1
-                            self.selections.append("None")
-                            continue
-                        self.selections.append(mod)  # regular mutation or cybernetic
-                        if mod in gamecodes["mod_bonuses"]:
-                            # some mutations or implants confer stat bonuses
-                            self.bonuses = list(
-                                map(add, self.bonuses, gamecodes["mod_bonuses"][mod])
-                            )
-                case ['XRL.CharacterBuilds.Qud.QudAttributesModule', *_]:
-                    pointspurchased = module['data']['PointsPurchased']
-                    base = 10 if self.genotype == 'Mutated Human' else 12
-                    self.attributes = []
-                    for attribute in ATTR_NAMES:
-                        self.attributes.append(base + pointspurchased[attribute])
-                case ['XRL.CharacterBuilds.Qud.QudCustomizeCharacterModule', *_]:
-                    self.name = module['data']['name']
-                    self.pet = module['data']['pet']
-                    self.gender = module['data']['gender']
-                    self.pronounSet = module['data']['pronounSet']
-                case ['XRL.CharacterBuilds.Qud.QudChooseStartingLocationModule', *_]:
-                    self.startinglocation = module['data']['StartingLocation']
-        self.tile = QudTile(filename=gamecodes['class_tiles'][self.subtype][0],
-                            colorstring=get_character_primary_color(self.selections),
-                            raw_tilecolor=get_character_primary_color(self.selections),
-                            raw_detailcolor=gamecodes['class_tiles'][self.subtype][1],
-                            qudname=self.subtype)
+            # moduleType is the module's class name, followed by its assembly
+            handler = MODULE_HANDLERS.get(module['moduleType'].partition(', ')[0])
+            if handler is not None:
+                handler(self, module['data'])
+
+    def _read_genotype(self, data: dict):
+        self.genotype = data['Genotype']
+
+    def _read_subtype(self, data: dict):
+        self.subtype = data['Subtype']
+        self.bonuses = list(CLASS_BONUSES[self.subtype])  # a copy, since selections add to it
+
+    def _read_selections(self, data: dict, noun: str):
+        self.selection_noun = noun
+        self.selections = []
+        for selection in data['selections']:
+            mod = selection[noun]
+            if selection['Count'] > 1:
+                # Unstable Genome stack
+                self.selections.append(mod + f' x{selection["Count"]}')
+                continue
+            if noun == 'Cybernetic' and mod is None:
+                # True Kin with no implant - +1 toughness
+                self.bonuses[2] += 1
+                self.selections.append("None")
+                continue
+            self.selections.append(mod)  # regular mutation or cybernetic
+            mod_bonuses = MOD_BONUSES.get(mod)
+            if mod_bonuses is not None:
+                # some mutations or implants confer stat bonuses
+                for index, bonus in mod_bonuses:
+                    self.bonuses[index] += bonus
+
+    def _read_mutations(self, data: dict):
+        self._read_selections(data, 'Mutation')
+
+    def _read_cybernetics(self, data: dict):
+        self._read_selections(data, 'Cybernetic')
+
+    def _read_attributes(self, data: dict):
+        pointspurchased = data['PointsPurchased']
+        base = 10 if self.genotype == 'Mutated Human' else 12
+        self.attributes = [base + pointspurchased[attribute] for attribute in ATTR_NAMES]
+
+    def _read_customization(self, data: dict):
+        self.name = data['name']
+        self.pet = data['pet']
+        self.gender = data['gender']
+        self.pronounSet = data['pronounSet']
+
+    def _read_starting_location(self, data: dict):
+        self.startinglocation = data['StartingLocation']
+
+    @property
+    def tile(self) -> QudTile:
+        """The character's class tile, only built once it is needed."""
+        if self._tile is None:
+            color = get_character_primary_color(self.selections)
+            self._tile = QudTile(filename=gamecodes['class_tiles'][self.subtype][0],
+                                 colorstring=color,
+                                 raw_tilecolor=color,
+                                 raw_detailcolor=gamecodes['class_tiles'][self.subtype][1],
+                                 qudname=self.subtype)
+        return self._tile
+
+    def build(self) -> Build:
+        """Return what the build stats record of the character."""
+        return Build(self.genotype, self.subtype, self.selection_noun, tuple(self.selections),
+                     self.startinglocation)
+
+    def thumbnail(self) -> bytes:
+        """Return the PNG of the character's class tile, shared with every character of the same
+        class and primary color."""
+        return class_thumbnail(self.subtype, get_character_primary_color(self.selections))
+
+    def thumbnail_filename(self) -> str:
+        return ''.join(ch for ch in self.subtype if ch.isalnum()) + '.png'
 
     def make_sheet(self) -> str:
         """Build a printable character sheet for the Character."""
@@ -88,7 +158,7 @@ class Character:
             else:
                 bonus_text = ''
             attr_strings.append(f'{attr_name:{width}}{attr:2}{bonus_text}')
-        if hasattr(self, 'name') and self.name is not None:
+        if self.name is not None:
             title = f'{self.name} the {self.genotype} {self.subtype}'
         else:
             title = f'{self.genotype} {self.subtype}'
@@ -101,6 +171,39 @@ class Character:
         return charsheet
 
 
+# stat bonuses from gamecodes, precomputed once: each class's bonuses in game order, and the
+# nonzero (attribute index, bonus) pairs of each mutation or implant that confers any
+CLASS_BONUSES = {subtype: tuple(bonuses)
+                 for subtype, bonuses in gamecodes['class_bonuses'].items()}
+MOD_BONUSES = {mod: tuple((index, bonus) for index, bonus in enumerate(bonuses) if bonus)
+               for mod, bonuses in gamecodes['mod_bonuses'].items()}
+
+# build code module class name -> the Character method that reads the module's data
+MODULE_HANDLERS = {
+    'XRL.CharacterBuilds.Qud.QudGenotypeModule': Character._read_genotype,
+    'XRL.CharacterBuilds.Qud.QudSubtypeModule': Character._read_subtype,
+    'XRL.CharacterBuilds.Qud.QudMutationsModule': Character._read_mutations,
+    'XRL.CharacterBuilds.Qud.QudCyberneticsModule': Character._read_cybernetics,
+    'XRL.CharacterBuilds.Qud.QudAttributesModule': Character._read_attributes,
+    'XRL.CharacterBuilds.Qud.QudCustomizeCharacterModule': Character._read_customization,
+    'XRL.CharacterBuilds.Qud.QudChooseStartingLocationModule': Character._read_starting_location,
+}
+
+
+@lru_cache(maxsize=None)  # there are only so many classes and colors
+def class_thumbnail(subtype: str, color: str) -> bytes:
+    """Return the PNG of a class tile painted with a primary color.
+
+    Args:
+        subtype: The character's class (calling or caste)
+        color: Primary color, from get_character_primary_color()
+    """
+    filename, detailcolor = gamecodes['class_tiles'][subtype]
+    tile = QudTile(filename=filename, colorstring=color, raw_tilecolor=color,
+                   raw_detailcolor=detailcolor, qudname=subtype)
+    return tile.get_big_bytesio().getvalue()
+
+
 def get_character_primary_color(extensions: List[str]) -> str:
     """Obtains a character's primary color.
 
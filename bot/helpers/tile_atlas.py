@@ -0,0 +1,173 @@
+"""A packed, memory-mapped atlas of every 16x24 game tile.
+
+Rendering a tile normally makes hagadias locate, open and decode the source image from the
+Textures directory, and every bot process keeps its own decoded copy in hagadias' image cache.
+The atlas packs the raw RGBA data of every small texture into a single file with an offset table
+keyed by texture path. Tiles are then read through a read-only mmap, so lookups need no file opens
+and all processes share the same pages through the OS page cache.
+
+File layout:
+    magic           4 bytes, b'QTA1'
+    index length    4 bytes, unsigned little-endian
+    index           UTF-8 JSON: {"signature": str, "tiles": {texture path: offset}}
+    tile data       TILE_BYTES of raw RGBA per tile, starting at a 16-byte boundary
+
+The atlas can be rebuilt manually with:
+    python -m bot.helpers.tile_atlas
+"""
+import json
+import logging
+import mmap
+import struct
+from pathlib import Path, PureWindowsPath
+from typing import Optional
+
+from hagadias import qudtile
+from PIL import Image
+
+log = logging.getLogger('bot.' + __name__)
+
+MAGIC = b'QTA1'
+HEADER = struct.Struct('<4sI')
+TILE_SIZE = (16, 24)
+TILE_BYTES = TILE_SIZE[0] * TILE_SIZE[1] * 4
+TEXTURE_SUFFIXES = ('.png', '.bmp')
+
+
+def atlas_key(filename: str) -> str:
+    """Normalize a texture path (as found in the XML or in the hagadias image cache) to the key
+    used in the atlas index."""
+    return PureWindowsPath(filename).as_posix().lower()
+
+
+def textures_signature(textures_dir: Path) -> str:
+    """Cheap fingerprint of the Textures directory, used to detect when the atlas is stale."""
+    count = 0
+    newest = 0
+    for path in textures_dir.rglob('*'):
+        if path.suffix.lower() in TEXTURE_SUFFIXES:
+            count += 1
+            newest = max(newest, path.stat().st_mtime_ns)
+    return f'{count}:{newest}'
+
+
+def build_atlas(textures_dir: Path, atlas_path: Path) -> int:
+    """Pack every 16x24 RGBA texture under textures_dir into a new atlas file.
+
+    Textures in any other size or mode are left out; hagadias keeps loading those from disk.
+    Returns the number of tiles packed."""
+    offsets = {}
+    data = bytearray()
+    for path in sorted(textures_dir.rglob('*')):
+        if path.suffix.lower() not in TEXTURE_SUFFIXES:
+            continue
+        try:
+            with Image.open(path) as image:
+                if image.size != TILE_SIZE or image.mode != 'RGBA':
+                    continue
+                raw = image.tobytes()
+        except OSError as e:
+            log.warning(f'Skipping unreadable texture {path}: {e}')
+            continue
+        offsets[atlas_key(str(path.relative_to(textures_dir)))] = len(data)
+        data += raw
+    index = json.dumps({'signature': textures_signature(textures_dir),
+                        'tiles': offsets}).encode('utf-8')
+    data_start = -(-(HEADER.size + len(index)) // 16) * 16  # round up to a 16-byte boundary
+    tmp_path = atlas_path.with_suffix(atlas_path.suffix + '.tmp')
+    with open(tmp_path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, len(index)))
+        f.write(index)
+        f.write(b'\0' * (data_start - HEADER.size - len(index)))
+        f.write(data)
+    # move into place atomically, so that running processes keep their old mapping intact
+    tmp_path.replace(atlas_path)
+    log.info(f'Packed {len(offsets)} tiles into {atlas_path} ({data_start + len(data)} bytes)')
+    return len(offsets)
+
+
+class TileAtlas:
+    """Read-only view over an atlas file built by build_atlas()."""
+
+    def __init__(self, atlas_path: Path):
+        with open(atlas_path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, index_len = HEADER.unpack_from(self._mmap)
+        if magic != MAGIC:
+            raise ValueError(f'{atlas_path} is not a tile atlas')
+        index = json.loads(self._mmap[HEADER.size:HEADER.size + index_len])
+        self.signature: str = index['signature']
+        data_start = -(-(HEADER.size + index_len) // 16) * 16
+        self._offsets: dict[str, int] = {key: data_start + offset
+                                         for key, offset in index['tiles'].items()}
+        self._view = memoryview(self._mmap)
+
+    def __len__(self):
+        return len(self._offsets)
+
+    def __contains__(self, filename: str) -> bool:
+        return atlas_key(filename) in self._offsets
+
+    def raw(self, filename: str) -> Optional[memoryview]:
+        """Return a zero-copy view of the raw RGBA bytes of a tile, or None if not packed."""
+        offset = self._offsets.get(atlas_key(filename))
+        if offset is None:
+            return None
+        return self._view[offset:offset + TILE_BYTES]
+
+    def image(self, filename: str) -> Optional[Image.Image]:
+        """Return a read-only PIL Image backed directly by the mapped atlas data, or None."""
+        raw = self.raw(filename)
+        if raw is None:
+            return None
+        return Image.frombuffer('RGBA', TILE_SIZE, raw, 'raw', 'RGBA', 0, 1)
+
+
+class AtlasImageCache(dict):
+    """Drop-in replacement for hagadias' image cache that serves tiles from a TileAtlas.
+
+    hagadias checks `filename in image_cache` and then copies `image_cache[filename]` before
+    coloring it, so serving atlas-backed images here keeps rendering identical while skipping
+    the file lookup and decode. Textures missing from the atlas are cached as usual."""
+
+    def __init__(self, atlas: TileAtlas, *args):
+        super().__init__(*args)
+        self.atlas = atlas
+
+    def __contains__(self, filename) -> bool:
+        return super().__contains__(filename) or filename in self.atlas
+
+    def __missing__(self, filename):
+        image = self.atlas.image(filename)
+        if image is None:
+            raise KeyError(filename)
+        return image
+
+
+def load_atlas(atlas_path: Path, textures_dir: Path = qudtile.tiles_dir) -> TileAtlas:
+    """Open the atlas at atlas_path, building or rebuilding it first if it is missing or the
+    Textures directory has changed since it was built."""
+    if atlas_path.exists():
+        atlas = TileAtlas(atlas_path)
+        if atlas.signature == textures_signature(textures_dir):
+            return atlas
+        log.info(f'Textures have changed since {atlas_path} was built, rebuilding.')
+    build_atlas(textures_dir, atlas_path)
+    return TileAtlas(atlas_path)
+
+
+def install_atlas(atlas_path: Path) -> Optional[TileAtlas]:
+    """Load the atlas and make hagadias read small tiles from it. Returns None if there are no
+    textures to pack."""
+    if not qudtile.tiles_dir.is_dir():
+        log.warning(f'No Textures directory at {qudtile.tiles_dir}, not using a tile atlas.')
+        return None
+    atlas = load_atlas(atlas_path)
+    qudtile.image_cache = AtlasImageCache(atlas, qudtile.image_cache)
+    return atlas
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    from bot.shared import config
+    build_atlas(qudtile.tiles_dir, Path(config.get('Tile atlas', 'tiles.atlas')))
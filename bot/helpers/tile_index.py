@@ -0,0 +1,60 @@
+"""Canonical render keys for game tiles.
+
+Many blueprints inherit their tile, so they render to exactly the same image. A render key
+identifies that image (source texture plus the colors it is painted with), so that memoized
+renders are produced once per unique visual rather than once per blueprint.
+"""
+import logging
+from typing import Optional
+
+from hagadias.qudtile import QudTile
+
+from bot.helpers.tile_atlas import atlas_key
+
+log = logging.getLogger('bot.' + __name__)
+
+
+def render_key(tile: Optional[QudTile]) -> Optional[tuple]:
+    """Return the render key for a QudTile, or None if its image can't be shared.
+
+    Tiles generated by a stand-in image provider (gases, vortexes...) have no source file, and
+    tiles with a prefab overlay are drawn specially for their object, so neither gets a key."""
+    if tile is None or tile.filename is None or tile.hasproblems \
+            or tile.prefab_applicator is not None:
+        return None
+    return (atlas_key(tile.filename), tile.tilecolor_letter, tile.detailcolor_letter,
+            tile.transparentcolor_letter)
+
+
+class TileIndex:
+    """Maps each blueprint name and tile variation index to the render key of its tile.
+
+    Tiles are indexed as they are rendered, rather than all at startup, since coloring every tile
+    of every blueprint up front is slow and keeps all of them in memory."""
+
+    def __init__(self):
+        self.keys: dict[tuple[str, int], Optional[tuple]] = {}
+
+    def key_for(self, name: str, variation: int, tile: Optional[QudTile]) -> Optional[tuple]:
+        """Return the render key for a blueprint's tile (or tile variation), indexing it first if
+        necessary."""
+        if (name, variation) not in self.keys:
+            self.keys[(name, variation)] = render_key(tile)
+            stats = self.stats()
+            log.debug(f"Indexed {stats['tiles']} rendered tiles: {stats['unique']} unique visuals"
+                      f" ({stats['unkeyed']} not shareable),"
+                      f" dedup ratio {stats['dedup_ratio']:.2f}")
+        return self.keys[(name, variation)]
+
+    def stats(self) -> dict:
+        """Return how many indexed tiles there are, and how many unique visuals they render to.
+
+        dedup_ratio is the number of tiles rendered with a shared key per unique render key."""
+        keyed = [key for key in self.keys.values() if key is not None]
+        unique = len(set(keyed))
+        return {
+            'tiles': len(self.keys),
+            'unique': unique,
+            'unkeyed': len(self.keys) - len(keyed),
+            'dedup_ratio': len(keyed) / unique if unique else 1.0,
+        }
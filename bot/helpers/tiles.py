@@ -2,17 +2,30 @@
 
 import asyncio
 import concurrent.futures
+import io
 import random
 from datetime import datetime
 from functools import partial
+from pathlib import Path
+from typing import Optional
 
 from hagadias.constants import QUD_COLORS
 from hagadias.qudtile import QudTile
 from hagadias.tileanimator import TileAnimator, GifHelper, StandInTiles
 
+from bot.helpers.cache import LRUCache
 from bot.helpers.find_blueprints import find_name_or_displayname, fuzzy_find_nearest
+from bot.helpers.tile_atlas import install_atlas
+from bot.helpers.tile_index import TileIndex, render_key
 from bot.helpers.tile_variations import parse_variation_parameters, get_tile_variation_details
-from bot.shared import qindex
+from bot.shared import config, qindex
+
+if config.get('Tile atlas'):
+    install_atlas(Path(config['Tile atlas']))
+
+tile_index = TileIndex()
+# encoded PNGs, keyed by (render key, big), shared by every blueprint with the same visual
+png_cache = LRUCache(max_entries=4096, max_bytes=64 * 1024 * 1024)
 
 
 class TileError(Exception):
@@ -105,10 +118,11 @@ async def get_tile_data(*args,
                        raw_transparent, image_provider=tile_provider)
     if gif_bytesio is not None:
         filedata = gif_bytesio
-    elif smalltile:
-        filedata = tile.get_bytesio()
+    elif recolor == '':  # the blueprint's own tile or variation, so index its render key
+        key = tile_index.key_for(obj.name, variation_result['idx'] if use_variation else 0, tile)
+        filedata = get_png_bytesio(tile, big=not smalltile, key=key)
     else:
-        filedata = tile.get_big_bytesio()
+        filedata = get_png_bytesio(tile, big=not smalltile)
     filedata.seek(0)
     if reading.isspace() or len(reading) == 0:
         msg += f"`{obj.name}` (display name: '{obj.displayname}'):"
@@ -157,7 +171,7 @@ async def get_tile_data_by_file(*args):
         raise TileError(f'The file {filename} is not allowed.')
     if tile.hasproblems:
         raise TileError('Was not able to generate that tile.')
-    filedata = tile.get_big_bytesio()
+    filedata = get_png_bytesio(tile)
     filedata.seek(0)
     msg = f'*Tile created from "{filename}":*'
     fname = datetime.now().strftime("%Y%m%d-%H%M%S")
@@ -165,6 +179,26 @@ async def get_tile_data_by_file(*args):
     return msg, filedata, filename
 
 
+def get_png_bytesio(tile: QudTile, big: bool = True, key: Optional[tuple] = None) -> io.BytesIO:
+    """Get a BytesIO of the PNG encoding of a tile, reusing the encoding of any previously
+    rendered tile with the same render key.
+
+    Args:
+        tile: The tile to encode
+        big: If True, encode the large 160x240 tile instead of the 16x24 one
+        key: The tile's render key, if already known
+    """
+    if key is None:
+        key = render_key(tile)
+    if key is None:
+        return tile.get_big_bytesio() if big else tile.get_bytesio()
+    png = png_cache.get((key, big))
+    if png is None:
+        png = (tile.get_big_bytesio() if big else tile.get_bytesio()).getvalue()
+        png_cache.put((key, big), png)
+    return io.BytesIO(png)
+
+
 def get_bytesio_for_object(qud_object, qud_tile: QudTile, hologram=False):
     """Provided a QudObject and a QudTile, creates a GIF and retrieves the associated BytesIO
     directly.
@@ -1,4 +1,7 @@
+import json
+import logging
 import re
+from collections import Counter
 from typing import Optional, List, Tuple
 from urllib.parse import urlencode
 from urllib.request import pathname2url
@@ -7,8 +10,11 @@ from discord import Message, Embed, Colour
 from discord.ext.commands import Context
 from yarl import URL
 
+from bot.helpers.cache import TTLCache
 from bot.shared import http_session
 
+log = logging.getLogger('bot.' + __name__)
+
 WIKI_FAVICON = 'https://wiki.cavesofqud.com/images/0/05/Wiki-icon-used-by-CoQ-Discord-bot.png'  # noqa E501
 WIKI_SINGLE_PAGE_EMBED_COLOR = Colour(0xc3c9b1)
 WIKI_PAGE_LIST_EMBED_COLOR = Colour(0xc3c9b1)
@@ -46,6 +52,22 @@ IGNORED_WIKI_IMAGES = [  # images to always ignore and not display in wikipage e
 ]
 
 
+# Seconds to reuse each kind of API reply for. Search results shift as pages are added or renamed,
+# while page contents and URLs rarely change once written.
+WIKI_CACHE_TTLS = {
+    'opensearch': 600,
+    'search': 600,
+    'parse': 1800,
+    'extracts': 1800,
+    'expandtemplates': 3600,
+    'pageids': 3600,
+}
+# recent API replies, with their size in bytes, keyed by endpoint and normalized request params
+wiki_cache = TTLCache(max_entries=1024, ttl=600, max_bytes=16 * 1024 * 1024,
+                      sizeof=lambda reply: reply[1])
+wiki_cache_counts = Counter()  # (endpoint, 'hits' or 'misses') -> count
+
+
 class WikiPageNotSpecifiedError(Exception):
     """Exception for use when a wiki page should have been specified but was not."""
     pass
@@ -103,8 +125,7 @@ class WikiPageSummary:
             'redirects': 1,
             'prop': 'images|wikitext',
         }
-        async with http_session.get(url=self.url, params=parse_params) as reply:
-            response = await reply.json()
+        response = await wiki_api_get(self.url, 'parse', parse_params)
         if 'error' in response:
             raise WikiAPIError(response['error'])
         # first grab the image from the full list of page images (less reliable - see below)
@@ -162,11 +183,10 @@ class WikiPageSummary:
         # for some reason, question marks get malformed in the request URL (converted to %3E) if
         # we use the following call. This seems to affect only the TextExtracts API:
         #     async with http_session.get(url=self.url, params=extract_params) as reply
-        # To fix it, we have to encode the URL ourselves for this particular API request. I took the
-        # workaround instructions from here: https://github.com/aio-libs/aiohttp/issues/3424
-        encoded_url = self.url + '?' + urlencode(extract_params)
-        async with http_session.get(url=URL(encoded_url, encoded=True)) as reply:
-            response = await reply.json()
+        # To fix it, we have to encode the URL ourselves for this particular API request (see
+        # wiki_api_get). I took the workaround instructions from here:
+        # https://github.com/aio-libs/aiohttp/issues/3424
+        response = await wiki_api_get(self.url, 'extracts', extract_params, encode_url=True)
         if 'error' in response:
             raise WikiAPIError(response['error'])
         elif '-1' in response['query']['pages']:  # alternate error indicator for TextExtracts API
@@ -237,8 +257,7 @@ class WikiPageSummary:
                     'text': img,
                     'prop': 'wikitext'
                 }
-                async with http_session.get(url=self.url, params=params) as reply:
-                    response = await reply.json()
+                response = await wiki_api_get(self.url, 'expandtemplates', params)
                 if 'error' in response:
                     return None  # TODO: consider logging an error here
                 img = response['expandtemplates']['wikitext']
@@ -273,8 +292,7 @@ class WikiPageSummary:
             'text': grammar_template,
             'prop': 'wikitext'
         }
-        async with http_session.get(url=self.url, params=params) as reply:
-            response = await reply.json()
+        response = await wiki_api_get(self.url, 'expandtemplates', params)
         if 'error' in response:
             return text_to_parse  # errors ignored; issues will be obvious in any non-parsed output
         return response['expandtemplates']['wikitext']
@@ -412,8 +430,7 @@ async def api_opensearch(api_url: str, query: str, limit: str, namespaces: str)
               'profile': 'fuzzy',
               'redirects': 'resolve',
               'format': 'json'}
-    async with http_session.get(url=api_url, params=params) as reply:
-        response = await reply.json()
+    response = await wiki_api_get(api_url, 'opensearch', params)
     if 'error' in response:
         return response['error'], None, None
     return None, response[1], response[3]
@@ -453,8 +470,7 @@ async def api_query_list_search(api_url: str, query: str, limit: str, namespaces
               'srwhat': 'text',
               'srlimit': limit,
               'srprop': 'snippet'}
-    async with http_session.get(url=api_url, params=params) as reply:
-        response = await reply.json()
+    response = await wiki_api_get(api_url, 'search', params)
     if 'error' in response:
         return response['error'], None, None, None, None
     results = response['query']['search']
@@ -593,9 +609,8 @@ async def pageids_to_urls(api_url: str, pageids: list) -> list:
               'action': 'query',
               'prop': 'info',
               'inprop': 'url',
-              'pageids': '|'.join(str_pageids)}
-    async with http_session.get(url=api_url, params=params) as reply:
-        response = await reply.json()
+              'pageids': '|'.join(sorted(str_pageids))}  # in any order, for more cache hits
+    response = await wiki_api_get(api_url, 'pageids', params)
     urls = [response['query']['pages'][str(pageid)]['fullurl'] for pageid in pageids]
     return urls
 
@@ -616,9 +631,8 @@ async def pageids_to_urls_and_snippets(api_url: str, pageids: list) -> Tuple[lis
               'exintro': 1,
               'explaintext': 1,
               'exchars': 120,
-              'pageids': '|'.join(str_pageids)}
-    async with http_session.get(url=api_url, params=params) as reply:
-        response = await reply.json()
+              'pageids': '|'.join(sorted(str_pageids))}  # in any order, for more cache hits
+    response = await wiki_api_get(api_url, 'pageids', params)
     urls = [response['query']['pages'][str(pageid)]['fullurl'] for pageid in pageids]
     summaries = [response['query']['pages'][str(pageid)]['extract'] for pageid in pageids]
     summaries = list(map(lambda s: s.replace('\n', ' '), summaries))
@@ -635,3 +649,47 @@ def encode_wiki_url_parens(wiki_url: str) -> str:
             url_parts[1] = url_parts[1].replace(paren, repl)
         wiki_url = url_parts[0] + '/' + url_parts[1]
     return wiki_url
+
+
+async def wiki_api_get(api_url: str, endpoint: str, params: dict, encode_url: bool = False):
+    """Submits a GET request to the wiki API and returns the decoded JSON reply. Successful replies
+    are cached for the endpoint's time in WIKI_CACHE_TTLS, and the same request is answered from
+    the cache until then. Callers must not modify the reply, since it may be shared.
+
+    Args:
+        api_url: the wiki API endpoint
+        endpoint: which kind of request this is, a key of WIKI_CACHE_TTLS
+        params: the request parameters
+        encode_url: whether to encode the parameters into the URL ourselves, rather than letting
+            aiohttp do it (see WikiPageSummary.load)
+    """
+    key = (api_url, endpoint, tuple(sorted((name, str(value)) for name, value in params.items())))
+    cached = wiki_cache.get(key)
+    if cached is not None:
+        wiki_cache_counts[endpoint, 'hits'] += 1
+        log.debug(f'Wiki cache hit for {endpoint} ({wiki_cache_stats()[endpoint]})')
+        return cached[0]
+    wiki_cache_counts[endpoint, 'misses'] += 1
+    if encode_url:
+        url, params = URL(api_url + '?' + urlencode(params), encoded=True), None
+    else:
+        url = api_url
+    async with http_session.get(url=url, params=params) as reply:
+        body = await reply.read()
+        status = reply.status
+    response = json.loads(body)
+    # errors may be temporary, so only successful replies are kept
+    if status == 200 and 'error' not in response:
+        wiki_cache.put(key, (response, len(body)), WIKI_CACHE_TTLS[endpoint])
+    return response
+
+
+def wiki_cache_stats() -> dict:
+    """Return the wiki cache metrics, along with the hits, misses and hit rate of each endpoint."""
+    stats = wiki_cache.stats()
+    for endpoint in WIKI_CACHE_TTLS:
+        hits = wiki_cache_counts[endpoint, 'hits']
+        misses = wiki_cache_counts[endpoint, 'misses']
+        stats[endpoint] = {'hits': hits, 'misses': misses,
+                           'hit_rate': hits / (hits + misses) if hits + misses else 0.0}
+    return stats
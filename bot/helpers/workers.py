@@ -0,0 +1,77 @@
+"""A shared worker pool for CPU-bound rendering jobs.
+
+Rendering images inline in a command coroutine blocks the event loop, which stalls every cog and
+the Discord heartbeat until it finishes. Jobs submitted with run_job() run on a small thread pool
+shared by all cogs (Pillow releases the GIL for most of its work), with a bound on how many jobs
+can be in flight at once and a time budget per job.
+"""
+import asyncio
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Callable
+
+from bot.shared import config
+
+log = logging.getLogger('bot.' + __name__)
+
+WORKERS = config.get('Render workers', 4)
+# jobs waiting for a free worker count against this too, so a burst of commands can't build up an
+# unbounded backlog
+MAX_IN_FLIGHT = WORKERS * 4
+
+pool = ThreadPoolExecutor(max_workers=WORKERS, thread_name_prefix='render')
+_in_flight = asyncio.Semaphore(MAX_IN_FLIGHT)
+
+
+class WorkerTimeout(Exception):
+    """Raised when a job does not finish within its time budget."""
+    pass
+
+
+async def run_job(name: str, func: Callable, *args, timeout: float = 10, **kwargs):
+    """Run func(*args, **kwargs) on the shared worker pool and return its result.
+
+    Exceptions raised by func are re-raised here. The time budget covers both waiting for a
+    free worker and running the job. A thread can't be interrupted, so a job that runs over
+    keeps its slot until it really finishes, but the caller stops waiting for it.
+
+    Args:
+        name: Short description of the job, for logging
+        func: The callable to run
+        timeout: Time budget in seconds
+    """
+    loop = asyncio.get_running_loop()
+    queued = time.perf_counter()
+    deadline = queued + timeout
+    try:
+        await asyncio.wait_for(_in_flight.acquire(), timeout)
+    except asyncio.TimeoutError:
+        log.warning(f'{name}: no free worker within {timeout} s, rejected')
+        raise WorkerTimeout
+    future = loop.run_in_executor(pool, partial(_timed, func, *args, **kwargs))
+    future.add_done_callback(_release)
+    try:
+        result, started, finished = await asyncio.wait_for(asyncio.shield(future),
+                                                           deadline - time.perf_counter())
+    except asyncio.TimeoutError:
+        log.warning(f'{name}: did not finish within its {timeout} s budget')
+        raise WorkerTimeout
+    log.info(f'{name}: queued {(started - queued) * 1000:.0f} ms,'
+             f' rendered {(finished - started) * 1000:.0f} ms')
+    return result
+
+
+def _release(future: asyncio.Future):
+    """Free the job's slot once the worker is really done with it."""
+    if not future.cancelled():
+        future.exception()  # mark as retrieved, in case the caller already gave up on it
+    _in_flight.release()
+
+
+def _timed(func: Callable, *args, **kwargs) -> tuple:
+    """Call func, and return its result along with when the worker started and finished it."""
+    started = time.perf_counter()
+    result = func(*args, **kwargs)
+    return result, started, time.perf_counter()
@@ -0,0 +1,178 @@
+"""Lightweight benchmark harness shared by the *_benchmark_test.py modules.
+
+Benchmarks are slow and need the game files, so they only run when the BENCHMARK environment
+variable is set:
+
+    BENCHMARK=1 python -m pytest -q tests/tile_benchmark_test.py
+
+Each suite writes its latest results to tests/benchmarks/<suite>.json. Run once with
+BENCHMARK_SAVE=1 to store those results as the baseline (tests/benchmarks/baseline/<suite>.json);
+later runs fail any case whose median latency (or retained memory, for memory cases) exceeds the
+baseline by more than BENCHMARK_TOLERANCE (a ratio, 1.25 by default).
+"""
+import json
+import os
+import time
+import tracemalloc
+from pathlib import Path
+from typing import Callable, Optional
+
+import pytest
+
+BENCHMARK = os.environ.get('BENCHMARK') in ('1', 'True', 'true')
+SAVE_BASELINE = os.environ.get('BENCHMARK_SAVE') in ('1', 'True', 'true')
+TOLERANCE = float(os.environ.get('BENCHMARK_TOLERANCE', '1.25'))
+RESULTS_DIR = Path(__file__).parent / 'benchmarks'
+BASELINE_DIR = RESULTS_DIR / 'baseline'
+
+# decorator for benchmark tests, so that they don't run as part of the regular test suite
+benchmark = pytest.mark.skipif(not BENCHMARK, reason="Set BENCHMARK=1 to run benchmarks")
+
+
+def percentile(samples: list, pct: float) -> float:
+    """Return the nearest-rank percentile of a list of samples."""
+    ordered = sorted(samples)
+    rank = max(0, min(len(ordered) - 1, round(pct / 100 * len(ordered)) - 1))
+    return ordered[rank]
+
+
+def output_size(result) -> int:
+    """Best-effort size in bytes of whatever a benchmarked call produced."""
+    if result is None:
+        return 0
+    if hasattr(result, 'getbuffer'):  # BytesIO
+        return result.getbuffer().nbytes
+    if isinstance(result, (bytes, bytearray, str)):
+        return len(result)
+    if isinstance(result, tuple):
+        return sum(output_size(item) for item in result)
+    return 0
+
+
+def summarize(timings: list, peak_alloc: int, produced: int) -> dict:
+    """Build the statistics dictionary for one benchmark case. Times are in milliseconds."""
+    return {
+        'rounds': len(timings),
+        'min_ms': min(timings),
+        'mean_ms': sum(timings) / len(timings),
+        'p50_ms': percentile(timings, 50),
+        'p90_ms': percentile(timings, 90),
+        'p95_ms': percentile(timings, 95),
+        'p99_ms': percentile(timings, 99),
+        'max_ms': max(timings),
+        'peak_alloc_bytes': peak_alloc,
+        'bytes_produced': produced,
+    }
+
+
+class BenchmarkSuite:
+    """Collects benchmark results for one suite and compares them against a stored baseline."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.results = {}
+        baseline_path = BASELINE_DIR / f'{name}.json'
+        if baseline_path.exists():
+            with open(baseline_path, encoding='utf-8') as f:
+                self.baseline = json.load(f)
+        else:
+            self.baseline = {}
+
+    def run(self, case: str, func: Callable, *args, rounds: int = 20, **kwargs) -> dict:
+        """Time a synchronous callable. One extra traced call measures allocations, so that
+        tracemalloc overhead does not distort the latency figures."""
+        func(*args, **kwargs)  # warm up caches
+        timings = []
+        for _ in range(rounds):
+            start = time.perf_counter()
+            func(*args, **kwargs)
+            timings.append((time.perf_counter() - start) * 1000)
+        tracemalloc.start()
+        result = func(*args, **kwargs)
+        peak_alloc = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        return self.record(case, summarize(timings, peak_alloc, output_size(result)))
+
+    async def run_async(self, case: str, func: Callable, *args, rounds: int = 20,
+                        **kwargs) -> dict:
+        """Time a coroutine function. See run()."""
+        await func(*args, **kwargs)
+        timings = []
+        for _ in range(rounds):
+            start = time.perf_counter()
+            await func(*args, **kwargs)
+            timings.append((time.perf_counter() - start) * 1000)
+        tracemalloc.start()
+        result = await func(*args, **kwargs)
+        peak_alloc = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        return self.record(case, summarize(timings, peak_alloc, output_size(result)))
+
+    def memory(self, case: str, func: Callable, *args, **kwargs) -> dict:
+        """Measure how much memory the result of calling func keeps alive, along with the peak
+        allocated while building it and how long that took."""
+        tracemalloc.start()
+        start = time.perf_counter()
+        result = func(*args, **kwargs)
+        elapsed = (time.perf_counter() - start) * 1000
+        retained, peak_alloc = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        del result
+        return self.record(case, {
+            'build_ms': elapsed,  # under tracemalloc, so only comparable to other memory cases
+            'retained_bytes': retained,
+            'peak_alloc_bytes': peak_alloc,
+        })
+
+    def record(self, case: str, stats: dict) -> dict:
+        """Store the statistics for a case and fail if it regressed against the baseline."""
+        self.results[case] = stats
+        regression = self.regression(case)
+        if regression is not None:
+            pytest.fail(regression)
+        return stats
+
+    def regression(self, case: str) -> Optional[str]:
+        """Return a description of the regression for a case, or None if there isn't one."""
+        if SAVE_BASELINE or case not in self.baseline:
+            return None
+        if 'retained_bytes' in self.results[case]:
+            before = self.baseline[case]['retained_bytes']
+            after = self.results[case]['retained_bytes']
+            if after > before * TOLERANCE:
+                return (f'{self.name}/{case}: retains {after} bytes, more than'
+                        f' baseline {before} bytes (tolerance {TOLERANCE}x)')
+            return None
+        before = self.baseline[case]['p50_ms']
+        after = self.results[case]['p50_ms']
+        if after > before * TOLERANCE:
+            return (f'{self.name}/{case}: median {after:.2f} ms is slower than'
+                    f' baseline {before:.2f} ms (tolerance {TOLERANCE}x)')
+        return None
+
+    def save(self):
+        """Write the results to disk, and to the baseline as well if BENCHMARK_SAVE is set."""
+        if not self.results:
+            return
+        RESULTS_DIR.mkdir(exist_ok=True)
+        targets = [RESULTS_DIR / f'{self.name}.json']
+        if SAVE_BASELINE:
+            BASELINE_DIR.mkdir(exist_ok=True)
+            targets.append(BASELINE_DIR / f'{self.name}.json')
+        for target in targets:
+            with open(target, 'w', encoding='utf-8') as f:
+                json.dump(self.results, f, indent=2, sort_keys=True)
+
+
+def suite_fixture(name: str):
+    """Return a module-scoped fixture that provides the BenchmarkSuite called name, and saves its
+    results once the module's tests are done. Benchmark modules assign it to `suite`:
+
+        suite = suite_fixture('tiles')
+    """
+    @pytest.fixture(scope='module')
+    def suite():
+        suite = BenchmarkSuite(name)
+        yield suite
+        suite.save()
+    return suite
@@ -0,0 +1,43 @@
+"""Tests for the build stats store."""
+from bot.helpers.build_stats import Build, BuildStats
+
+BUILDS = [
+    Build('Mutated Human', 'Scholar', 'Mutation', ('Chimera', 'Beak'), 'Joppa'),
+    Build('Mutated Human', 'Pilgrim', 'Mutation', ('Beak', 'Unstable Genome x2'), 'Joppa'),
+    Build('True Kin', 'Artifex', 'Cybernetic', ('None',), 'Kyakukya'),
+]
+
+
+def test_build_stats_counts(tmp_path):
+    """Check the running counts, and that they survive reopening the database."""
+    stats = BuildStats(tmp_path / 'builds.sqlite3')
+    for build in BUILDS:
+        stats.record(build, b'hash')
+    assert stats.total() == 3
+    assert stats.top('genotype') == [('Mutated Human', 2), ('True Kin', 1)]
+    assert stats.top('mutation', 2) == [('Beak', 2), ('Chimera', 1)]
+    assert ('Unstable Genome', 1) in stats.top('mutation')
+    assert stats.top('cybernetic') == [('None', 1)]
+    stats.close()
+    stats = BuildStats(tmp_path / 'builds.sqlite3')
+    stats.record(BUILDS[2], b'hash')
+    assert stats.total() == 4
+    assert stats.top('starting location') == [('Joppa', 2), ('Kyakukya', 2)]
+    stats.close()
+
+
+def test_build_stats_callings_and_castes(tmp_path):
+    """Check that callings and castes are counted apart, and backfilled into older databases."""
+    stats = BuildStats(tmp_path / 'builds.sqlite3')
+    for build in BUILDS:
+        stats.record(build, b'hash')
+    assert stats.top('calling') == [('Pilgrim', 1), ('Scholar', 1)]
+    assert stats.top('caste') == [('Artifex', 1)]
+    # as recorded before callings and castes were counted
+    with stats.db:
+        stats.db.execute("DELETE FROM build_counts WHERE category IN ('calling', 'caste')")
+    stats.close()
+    stats = BuildStats(tmp_path / 'builds.sqlite3')
+    assert stats.top('calling') == [('Pilgrim', 1), ('Scholar', 1)]
+    assert stats.top('caste') == [('Artifex', 1)]
+    stats.close()
@@ -0,0 +1,49 @@
+"""Tests for the shared LRU cache."""
+from bot.helpers.cache import LRUCache, TTLCache
+
+
+def test_lru_eviction_order():
+    """Check that the least recently used entry is evicted first."""
+    cache = LRUCache(max_entries=2)
+    cache.put('a', 1)
+    cache.put('b', 2)
+    assert cache.get('a') == 1  # 'b' is now the least recently used
+    cache.put('c', 3)
+    assert 'b' not in cache
+    assert cache.get('a') == 1 and cache.get('c') == 3
+    assert cache.evictions == 1
+
+
+def test_lru_byte_limit():
+    """Check the byte bound, including values too large to store at all."""
+    cache = LRUCache(max_entries=10, max_bytes=10)
+    cache.put('a', b'12345')
+    cache.put('b', b'12345')
+    cache.put('c', b'1')
+    assert 'a' not in cache and cache.bytes == 6
+    cache.put('huge', b'x' * 11)
+    assert 'huge' not in cache
+
+
+def test_lru_stats():
+    """Check hit and miss counting."""
+    cache = LRUCache(max_entries=2)
+    cache.put('a', 1)
+    cache.get('a')
+    cache.get('missing')
+    stats = cache.stats()
+    assert stats['hits'] == 1 and stats['misses'] == 1 and stats['hit_rate'] == 0.5
+
+
+def test_ttl_expiry():
+    """Check that entries expire after their own ttl, and count as misses once they have."""
+    now = [0.0]
+    cache = TTLCache(max_entries=10, ttl=10, clock=lambda: now[0])
+    cache.put('default', 1)
+    cache.put('short', 2, ttl=1)
+    now[0] = 5
+    assert cache.get('short') is None and cache.get('default') == 1
+    now[0] = 10
+    assert cache.get('default') is None
+    stats = cache.stats()
+    assert stats['expirations'] == 2 and stats['misses'] == 2 and stats['entries'] == 0
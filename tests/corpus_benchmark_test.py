@@ -0,0 +1,49 @@
+"""Benchmarks for the Markov corpus: loading, memory use, phrase lookups and sentence generation.
+
+Skipped unless BENCHMARK=1 is set. See tests/benchmark.py for details."""
+import hashlib
+
+import pytest
+
+from bot.helpers.corpus import COMPILED_PATH, corpus, Corpus, JSON_PATH
+from tests.benchmark import benchmark, suite_fixture
+
+# fixed queries from the game's corpus, so that results are comparable between runs
+ONE_WORD = ['the', 'Welcome', 'passage', 'Salum']
+TWO_WORDS = ['You are', 'Return to', 'wide passage', 'in my']
+PUNCTUATED = ["Ol'", 'Curious.']  # not plain words, so these scan every key
+SENTENCES = 200  # per timed round
+
+pytestmark = benchmark
+suite = suite_fixture('corpus')
+
+
+def load_json() -> Corpus:
+    loaded = Corpus.__new__(Corpus)  # without loading the corpus in __init__
+    loaded.load_json(JSON_PATH)
+    return loaded
+
+
+def load_compiled() -> Corpus:
+    loaded = Corpus.__new__(Corpus)
+    loaded.load_compiled(COMPILED_PATH, hashlib.sha256(JSON_PATH.read_bytes()).hexdigest())
+    return loaded
+
+
+def test_load(suite):
+    suite.run('load/json', load_json, rounds=5)
+    suite.run('load/compiled', load_compiled, rounds=5)
+
+
+def test_memory(suite):
+    suite.memory('memory/corpus', load_json)
+
+
+@pytest.mark.parametrize('query', ONE_WORD + TWO_WORDS + PUNCTUATED)
+def test_get_pairs(suite, query):
+    suite.run(f'get_pairs/{query}', corpus.get_pairs, query.split(), rounds=200)
+
+
+def test_generate_sentence(suite):
+    suite.run('generate/single', lambda: [corpus.generate_sentence() for _ in range(SENTENCES)])
+    suite.run('generate/batch', corpus.generate_sentences, SENTENCES)
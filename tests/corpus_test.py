@@ -1,8 +1,10 @@
 """
 Pytest tests for the single instance of Corpus in corpus.py
 """
+import asyncio
 
-from bot.helpers.corpus import corpus
+from bot.helpers import corpus as corpus_module
+from bot.helpers.corpus import alias_table, corpus, Corpus, JSON_PATH, SentencePool
 
 
 def test_corpus():
@@ -39,3 +41,49 @@ def test_corpus():
 def test_secret_generation():
     """Test generation of Ruin of House Isner secret"""
     corpus.generate_sentence(seed="isner test")
+
+
+def test_sentence_pool():
+    """Test that the sentence pool fills up and serves from it"""
+    pool = SentencePool(corpus, size=4, batch=3)
+    assert len(pool.get()) > 0  # empty pool: generated on demand
+    assert asyncio.run(pool.fill()) == 4
+    assert len(pool.get()) > 0
+    stats = pool.stats()
+    assert stats['hits'] == 1 and stats['misses'] == 1 and stats['ready'] == 3
+
+
+def test_truncated_compiled_corpus(tmp_path):
+    """Test that a truncated compiled corpus is recompiled instead of failing to load"""
+    compiled_path = tmp_path / 'LibraryCorpus.compiled'
+    compiled_path.write_bytes(b'QMC')
+    loaded = Corpus.__new__(Corpus)  # without loading the corpus in __init__
+    loaded.load(JSON_PATH, compiled_path)
+    assert len(loaded.keys) == len(corpus.keys)
+    assert compiled_path.stat().st_size > 8
+
+
+class DeadEndCorpus:
+    """Stands in for a corpus whose every sentence runs into a dead end."""
+    def generate_sentences(self, count, seed="", skip_dead_ends=False):
+        return []
+
+
+def test_sentence_pool_gives_up(monkeypatch):
+    """Test that the sentence pool stops refilling when batches keep coming up empty"""
+    monkeypatch.setattr(corpus_module, 'POOL_RETRY_DELAY', 0)
+    pool = SentencePool(DeadEndCorpus(), size=4, batch=3)
+    assert asyncio.run(pool.fill()) == 0
+    assert len(pool) == 0
+
+
+def test_alias_table():
+    """Test that alias tables pick each successor as often as it appears"""
+    counts = [5, 1, 1, 3, 10]
+    probability, alias = alias_table(counts)
+    picked = [0.0] * len(counts)
+    for column, (keep, other) in enumerate(zip(probability, alias)):
+        picked[column] += keep / len(counts)
+        picked[other] += (1 - keep) / len(counts)
+    for chance, count in zip(picked, counts):
+        assert abs(chance - count / sum(counts)) < 1e-9
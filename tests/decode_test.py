@@ -0,0 +1,38 @@
+"""Tests for finding build codes in messages."""
+import base64
+import gzip
+from collections import Counter
+
+from bot.cogs.decode import find_build_codes
+
+
+def make_code(content: bytes) -> str:
+    return base64.b64encode(gzip.compress(content + bytes(range(256)))).decode()
+
+
+CODES = [make_code(bytes([number])) for number in range(3)]
+
+
+def test_find_build_codes_rejects():
+    """Check which stage rejects each kind of message, and the counts."""
+    counts = Counter()
+    assert find_build_codes('Nice build!', counts, 5) == []
+    assert find_build_codes('x' * 100, counts, 5) == []
+    assert find_build_codes('H4sI' + '!' * 100, counts, 5) == []
+    assert counts == Counter({'scanned': 3, 'rejected: too short': 1,
+                              'rejected: no gzip magic': 1, 'rejected: no regex match': 1})
+
+
+def test_find_build_codes_several():
+    """Check that codes are found in order, without repeats, inside other text."""
+    counts = Counter()
+    content = f'mine: `{CODES[0]}` and\n{CODES[1]}, again {CODES[0]}'
+    assert find_build_codes(content, counts, 5) == CODES[:2]
+    assert counts['matched'] == 1 and counts['codes'] == 2
+
+
+def test_find_build_codes_limit():
+    """Check that no more than limit codes are returned."""
+    counts = Counter()
+    assert find_build_codes(' '.join(CODES), counts, 2) == CODES[:2]
+    assert counts['codes'] == 2
@@ -0,0 +1,36 @@
+"""Tests for the ?say message box renderer."""
+import pytest
+from PIL import ImageDraw
+
+from bot.helpers import font
+from bot.helpers.font import drawttf, drawttf_key, FONT
+
+SAYINGS = [
+    ('Live and drink, friend. May you find shade in Joppa.', '-d', 'Mehmet'),
+    ('There are {{R|hostiles}} nearby!', '-p', ''),
+    ('{{r-R-R-W-W-w-w sequence|La Jeunesse}} is\nhere, with {{rainbow|many colors}}.', '-p', ''),
+    ('Sleeeeeeeep. ' * 40, '-d', '{{c|Drowsing}} Urchin'),
+]
+
+
+def draw_with_freetype(image, xy, char, color):
+    """The original per-character renderer that the glyph atlas replaces."""
+    ImageDraw.Draw(image).text(xy, char, font=FONT, fill=color)
+
+
+@pytest.mark.parametrize('saying,border,title', SAYINGS)
+def test_glyph_atlas_matches_draw_text(monkeypatch, saying, border, title):
+    """Check that rendering through the glyph atlas is pixel-identical to draw.text."""
+    atlas_image = drawttf(saying, border, title)
+    monkeypatch.setattr(font.GLYPHS, 'draw', draw_with_freetype)
+    freetype_image = drawttf(saying, border, title)
+    assert atlas_image.tobytes() == freetype_image.tobytes()
+
+
+def test_drawttf_key():
+    """Check that border aliases share a key, and that randomized shaders get none."""
+    assert drawttf_key('Hi', '-popupclassic', 'Mehmet') == drawttf_key('Hi', None, '') \
+        == ('Hi', '-p', '')
+    assert drawttf_key('Hi', '-d', None) == ('Hi', '-d', '')
+    assert drawttf_key('{{chaotic|Hi}}', '-p', '') is None
+    assert drawttf_key('Hi', '-d', '{{random|Mehmet}}') is None
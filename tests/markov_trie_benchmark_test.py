@@ -0,0 +1,72 @@
+"""Benchmarks comparing the variable-order suffix trie with a flat chain dict of successor lists,
+for memory use and generation throughput.
+
+Skipped unless BENCHMARK=1 is set. See tests/benchmark.py for details."""
+import json
+import random
+
+import pytest
+
+from bot.helpers.corpus import JSON_PATH
+from bot.helpers.markov_trie import MAX_ORDER, SuffixTrie
+from tests.benchmark import benchmark, suite_fixture
+
+SENTENCES = 200  # per timed round
+ORDERS = range(1, MAX_ORDER + 1)
+
+pytestmark = benchmark
+suite = suite_fixture('markov_trie')
+
+
+@pytest.fixture(scope='module')
+def data():
+    with open(JSON_PATH, encoding='utf-8') as f:
+        return json.load(f)
+
+
+@pytest.fixture(scope='module')
+def tries(data):
+    return {order: SuffixTrie(data, order) for order in ORDERS}
+
+
+def chain_dict(data: dict) -> dict:
+    """The chain as a dict of successor lists, keeping repeats so they are picked as often."""
+    chain = {}
+    for key, values in zip(data["keys"], data["values"]):
+        if len(values):
+            chain.setdefault(key, []).extend(values.split('\u0001'))
+    return chain
+
+
+def generate_from_chain(chain: dict, data: dict, count: int) -> list[str]:
+    sentences = []
+    for _ in range(count):
+        words = random.choice(data["OpeningWords"]).split(' ')
+        for _ in range(100):
+            successors = chain.get(' '.join(words[-data["order"]:]))
+            if successors is None:
+                break
+            words.append(random.choice(successors))
+            if '.' in words[-1]:
+                break
+        sentences.append(' '.join(words))
+    return sentences
+
+
+def generate_from_trie(trie: SuffixTrie, count: int) -> list[str]:
+    return [trie.generate_sentence() for _ in range(count)]
+
+
+def test_memory(suite, data):
+    suite.memory('memory/chain-dict', chain_dict, data)
+    for order in ORDERS:
+        suite.memory(f'memory/trie-order{order}', SuffixTrie, data, order)
+
+
+def test_generate_chain_dict(suite, data):
+    suite.run('generate/chain-dict', generate_from_chain, chain_dict(data), data, SENTENCES)
+
+
+@pytest.mark.parametrize('order', ORDERS)
+def test_generate_trie(suite, tries, order):
+    suite.run(f'generate/trie-order{order}', generate_from_trie, tries[order], SENTENCES)
@@ -0,0 +1,44 @@
+"""Tests for the variable-order suffix trie."""
+from bot.helpers.markov_trie import SuffixTrie
+
+DATA = {
+    "order": 2,
+    "keys": ["the red", "a red", "red fox", "fox ran", "the red"],
+    "values": ["fox\u0001fox", "hen.", "ran", "away.", "fox"],
+    "OpeningWords": ["the red"],
+}
+
+
+def successors(trie: SuffixTrie, node: int) -> dict:
+    """The successor words of a trie node and their probabilities."""
+    tokens = trie.tokens[trie.offsets[node]:trie.offsets[node + 1]]
+    picked = {}
+    for column in range(len(tokens)):
+        start = trie.offsets[node]
+        keep = trie.probability[start + column]
+        for index, chance in ((start + column, keep), (trie.alias[start + column], 1 - keep)):
+            word = trie.vocabulary[trie.tokens[index]]
+            picked[word] = picked.get(word, 0) + chance / len(tokens)
+    return picked
+
+
+def test_backoff():
+    """Test that unseen contexts back off to the longest known one"""
+    trie = SuffixTrie(DATA, max_order=4)
+    token = trie.token_ids.get
+    # order 2 context seen in the corpus
+    assert successors(trie, trie.context([token('the'), token('red')], 2)) == {'fox': 1.0}
+    # "big red" was never seen, so only "red" is used: fox three times, hen once
+    probabilities = successors(trie, trie.context([None, token('red')], 2))
+    assert abs(probabilities['fox'] - 0.75) < 1e-9 and abs(probabilities['hen.'] - 0.25) < 1e-9
+    # nothing known at all: the root, which has every successor
+    assert set(successors(trie, trie.context([None], 4))) == {'fox', 'hen.', 'ran', 'away.'}
+    # order 1 ignores the older word
+    assert trie.context([token('the'), token('red')], 1) == trie.context([token('red')], 1)
+
+
+def test_generate():
+    """Test that generation works from seeds that aren't chain keys"""
+    trie = SuffixTrie(DATA)
+    assert trie.generate_sentence().startswith('the red')
+    assert trie.generate_sentence('a big red', order=3).startswith('a big red ')
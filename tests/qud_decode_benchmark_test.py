@@ -0,0 +1,50 @@
+"""Benchmarks for decoding build codes into characters and character sheets.
+
+Each timed round decodes every build code in the test cases ROUNDS times, so divide the timings
+by the number of decodes for the cost of one. The memory cases keep DECODES characters alive, to
+show what each one costs.
+
+Skipped unless BENCHMARK=1 is set. See tests/benchmark.py for details."""
+import pytest
+
+from bot.helpers.qud_decode import Character, decode_build_code
+from tests.benchmark import benchmark, suite_fixture
+from tests.qud_decode_test import CASES
+
+CODES = [case[0] for case in CASES]  # real build codes from the game
+ROUNDS = 500
+DECODES = ROUNDS * len(CODES)
+MAX_SIZE = 1024 * 1024
+
+pytestmark = benchmark
+suite = suite_fixture('qud_decode')
+
+
+@pytest.fixture(scope='module')
+def decoded():
+    return [decode_build_code(code, MAX_SIZE) for code in CODES]
+
+
+def decode_codes() -> list[dict]:
+    return [decode_build_code(code, MAX_SIZE) for _ in range(ROUNDS) for code in CODES]
+
+
+def characters(decoded: list[dict]) -> list[Character]:
+    return [Character(code) for _ in range(ROUNDS) for code in decoded]
+
+
+def sheets(decoded: list[dict]) -> list[str]:
+    return [Character(code).make_sheet() for _ in range(ROUNDS) for code in decoded]
+
+
+def test_decode(suite):
+    suite.run(f'decode/build-code-x{DECODES}', decode_codes)
+
+
+def test_character(suite, decoded):
+    suite.run(f'decode/character-x{DECODES}', characters, decoded)
+    suite.memory(f'memory/characters-x{DECODES}', characters, decoded)
+
+
+def test_sheet(suite, decoded):
+    suite.run(f'decode/sheet-x{DECODES}', sheets, decoded)
@@ -5,7 +5,7 @@ import json
 
 import pytest
 
-from bot.helpers.qud_decode import Character
+from bot.helpers.qud_decode import BuildCodeError, Character, decode_build_code
 
 # Test cases are lists in this format:
 # [
@@ -59,3 +59,21 @@ def test_decode_make_sheet(test_input, _, __):
     char = Character(code)
     sheet = char.make_sheet()
     assert len(sheet) > 100
+
+
+@pytest.mark.parametrize("test_input,_,__", CASES)
+def test_decode_build_code(test_input, _, __):
+    """Check that the bounded decoder gives the same result as plain gunzipping."""
+    expected = json.loads(gzip.decompress(base64.b64decode(test_input)).decode(encoding='utf-8'))
+    assert decode_build_code(test_input, 1024 * 1024) == expected
+
+
+@pytest.mark.parametrize("test_input,reason", [
+    (base64.b64encode(gzip.compress(b' ' * 10_000_000)).decode(), 'more than'),  # gzip bomb
+    (CASES[0][0][:200], 'truncated'),
+    (base64.b64encode(b'not gzip at all').decode(), 'not gzip'),
+])
+def test_decode_build_code_rejects(test_input, reason):
+    """Check that oversized and broken build codes are rejected with a reason."""
+    with pytest.raises(BuildCodeError, match=reason):
+        decode_build_code(test_input, 1024 * 1024)
@@ -0,0 +1,44 @@
+"""Benchmarks for the ?say message box renderer.
+
+Skipped unless BENCHMARK=1 is set. See tests/benchmark.py for details."""
+import pytest
+
+from bot.helpers import font
+from bot.helpers.font import drawttf, layoutttf
+from tests.benchmark import benchmark, suite_fixture
+from tests.font_test import draw_with_freetype
+
+SAYINGS = {
+    'short': ('There are hostiles nearby!', '-p', ''),
+    'dialogue': ('Live and drink, friend. May you find shade in Joppa.', '-d', 'Mehmet'),
+    'long': ('Sleeeeeeeep and dream of the {{c|Spindle}}. ' * 20, '-d', 'Drowsing Urchin'),
+    'shaders': ('{{rainbow|The sky is falling}} {{r-R-R-W-W-w-w sequence|and burning}}. ' * 12,
+                '-p', ''),
+}
+
+# long strings of repeated shader markup, for the layout stage on its own
+SHADER_HEAVY = {
+    'sequences': '{{r-R-R-W-W-w-w sequence|Jeunesse}} {{rainbow|of}} {{K-y sequence|the}} ' * 40,
+    'alternations': '{{c-C-Y-W alternation|maghammer}} {{b-B bordered|dromad}} ' * 40,
+    'nested': '{{K|{{crysteel|crysteel}} mace and {{R|blood}}}} ' * 40,
+}
+
+pytestmark = benchmark
+suite = suite_fixture('say')
+
+
+@pytest.mark.parametrize('case', SAYINGS)
+def test_drawttf(suite, case):
+    suite.run(f'glyph-atlas/{case}', drawttf, *SAYINGS[case])
+
+
+@pytest.mark.parametrize('case', SAYINGS)
+def test_drawttf_freetype(suite, monkeypatch, case):
+    """The same renders through per-character draw.text, for a before/after comparison."""
+    monkeypatch.setattr(font.GLYPHS, 'draw', draw_with_freetype)
+    suite.run(f'freetype/{case}', drawttf, *SAYINGS[case])
+
+
+@pytest.mark.parametrize('case', SHADER_HEAVY)
+def test_layoutttf(suite, case):
+    suite.run(f'layout/{case}', layoutttf, SHADER_HEAVY[case], '-p', '', rounds=50)
@@ -0,0 +1,99 @@
+"""Benchmarks for the tile rendering paths used by the Tiles cog.
+
+The PNG cache is cleared before every round of the rendering cases, so that they time the
+rendering itself; the static-cached cases time a cache hit.
+
+Skipped unless BENCHMARK=1 is set. See tests/benchmark.py for details."""
+import os
+
+import pytest
+
+from bot.helpers.tiles import get_tile_data, get_tile_data_by_file, get_bytesio_for_object, \
+    png_cache
+from bot.shared import qindex
+from tests.benchmark import benchmark, suite_fixture
+
+# is this test running in a CI environment? (GitHub Workflows)
+CI = os.environ.get('CI') in ('True', 'true')
+
+# fixed queries, so that results are comparable between runs
+STATIC = ['Glowfish', 'Snapjaw Scavenger', 'Waterskin', 'Chrome Pyramid']
+RECOLORED = ['Glowfish recolor r R', 'Waterskin recolor B c']
+VARIATIONS = ['flowers variation 3', 'hypertractor unidentified']
+ANIMATED = ['Forcefield', 'Space-Time Anomaly']
+HOLOGRAM = ['Glowfish', 'Snapjaw Scavenger']
+BY_FILE = ['creatures/sw_glowfish.bmp o O', 'items/sw_waterskin.bmp c C']
+
+pytestmark = [benchmark, pytest.mark.skipif(CI, reason="Skipping due to no textures")]
+
+
+suite = suite_fixture('tiles')
+
+
+async def uncached(func, *args, **kwargs):
+    """Call func with an empty PNG cache, so that every round really renders the tile."""
+    png_cache.clear()
+    return await func(*args, **kwargs)
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('query', STATIC)
+async def test_static(suite, query):
+    await suite.run_async(f'static/{query}', uncached, get_tile_data, *query.split())
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('query', STATIC)
+async def test_static_cached(suite, query):
+    await suite.run_async(f'static-cached/{query}', get_tile_data, *query.split())
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('query', STATIC)
+async def test_static_small(suite, query):
+    await suite.run_async(f'small/{query}', uncached, get_tile_data, *query.split(), smalltile=True)
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('query', RECOLORED)
+async def test_recolored(suite, query):
+    await suite.run_async(f'recolor/{query}', uncached, get_tile_data, *query.split())
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('query', VARIATIONS)
+async def test_variation(suite, query):
+    await suite.run_async(f'variation/{query}', uncached, get_tile_data, *query.split())
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('query', ANIMATED)
+async def test_animated(suite, query):
+    await suite.run_async(f'animated/{query}', get_tile_data, *query.split(), animated=True,
+                          rounds=5)
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('query', HOLOGRAM)
+async def test_hologram(suite, query):
+    await suite.run_async(f'hologram/{query}', get_tile_data, *query.split(), hologram=True,
+                          rounds=5)
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('query', BY_FILE)
+async def test_by_file(suite, query):
+    await suite.run_async(f'byfile/{query}', uncached, get_tile_data_by_file, *query.split())
+
+
+@pytest.mark.parametrize('name', ANIMATED)
+def test_bytesio_for_object(suite, name):
+    obj = qindex[name]
+    suite.run(f'gif/{name}', get_bytesio_for_object, obj, obj.tile, rounds=5)
+
+
+@pytest.mark.parametrize('name', HOLOGRAM)
+def test_bytesio_for_object_hologram(suite, name):
+    obj = qindex[name]
+    suite.run(f'gif-hologram/{name}', get_bytesio_for_object, obj, obj.tile, hologram=True,
+              rounds=5)
@@ -0,0 +1,115 @@
+"""Benchmarks for ?wiki searches, against a local stub of the wiki API that answers each kind of
+request after a fixed delay. Compares the searches sent one after the other, as ?wiki used to,
+with the concurrent searches of Wiki.wiki_helper, and times the partial answer given when one
+search is slower than the time budget. The wiki cache is cleared before every search.
+
+Skipped unless BENCHMARK=1 is set. See tests/benchmark.py for details."""
+import asyncio
+from contextlib import asynccontextmanager
+from types import SimpleNamespace
+
+import aiohttp
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from bot.cogs.wiki import Wiki
+from bot.helpers import wiki_page
+from bot.helpers.wiki_page import api_opensearch, api_query_list_search, \
+    merge_wikipage_results, send_wiki_page_list
+from tests.benchmark import benchmark, suite_fixture
+
+# seconds the stub wiki takes to answer each kind of request
+LATENCY = {'opensearch': 0.08, 'search': 0.12, 'pageids': 0.04}
+PAGES = [f'Page {number}' for number in range(20)]
+QUERY = 'yonder'
+NAMESPACES = 'Main,Category,Modding'
+LIMIT = 10
+ROUNDS = 40
+
+pytestmark = benchmark
+suite = suite_fixture('wiki')
+
+
+def page_url(title: str) -> str:
+    return f'https://wiki.example/{title.replace(" ", "_")}'
+
+
+async def stub_api(request: web.Request) -> web.Response:
+    """Answer opensearch, query&list=search and page id lookups with made-up pages."""
+    params = request.query
+    if params.get('action') == 'opensearch':
+        kind = 'opensearch'
+        titles = PAGES[:int(params['limit'])]
+        reply = [params['search'], titles, [''] * len(titles), [page_url(t) for t in titles]]
+    elif params.get('list') == 'search':
+        kind = 'search'
+        # overlaps the opensearch results, like the real wiki does
+        reply = {'query': {'search': [{'title': title, 'pageid': PAGES.index(title)}
+                                      for title in PAGES[1:int(params['srlimit']) + 1]]}}
+    else:
+        kind = 'pageids'
+        reply = {'query': {'pages': {pageid: {'fullurl': page_url(PAGES[int(pageid)])}
+                                     for pageid in params['pageids'].split('|')}}}
+    await asyncio.sleep(request.app['latency'][kind])
+    return web.json_response(reply)
+
+
+@asynccontextmanager
+async def stub_wiki(latency: dict, monkeypatch):
+    """Run the stub wiki, and yield its API URL."""
+    app = web.Application()
+    app['latency'] = latency
+    app.router.add_get('/api.php', stub_api)
+    server = TestServer(app)
+    await server.start_server()
+    async with aiohttp.ClientSession() as session:
+        monkeypatch.setattr(wiki_page, 'http_session', session)
+        yield str(server.make_url('/api.php'))
+    await server.close()
+
+
+def make_ctx() -> SimpleNamespace:
+    async def send(*args, **kwargs):
+        pass
+    message = SimpleNamespace(channel='benchmark', author='benchmark', content=f'?wiki {QUERY}')
+    return SimpleNamespace(message=message, send=send)
+
+
+def make_wiki(url: str, time_budget: float) -> Wiki:
+    wiki = Wiki.__new__(Wiki)  # without the bot and config
+    wiki.url = url
+    wiki.basic_limit = LIMIT
+    wiki.search_time_budget = time_budget
+    return wiki
+
+
+async def sequential_search(url: str, ctx: SimpleNamespace):
+    """?wiki as it was before its searches were sent concurrently."""
+    wiki_page.wiki_cache.clear()
+    o_err, o_titles, o_urls = await api_opensearch(url, QUERY, str(LIMIT // 4), NAMESPACES)
+    err, titles, urls, _, _ = await api_query_list_search(url, QUERY, LIMIT, NAMESPACES,
+                                                          retrieve_snippets=False)
+    titles, urls = merge_wikipage_results((o_titles, o_urls), (titles, urls), LIMIT)
+    return await send_wiki_page_list(ctx, titles, urls)
+
+
+async def concurrent_search(wiki: Wiki, ctx: SimpleNamespace):
+    wiki_page.wiki_cache.clear()
+    return await wiki.wiki_helper(None, ctx, QUERY)
+
+
+@pytest.mark.asyncio
+async def test_search(suite, monkeypatch):
+    async with stub_wiki(LATENCY, monkeypatch) as url:
+        await suite.run_async('search/sequential', sequential_search, url, make_ctx(),
+                              rounds=ROUNDS)
+        await suite.run_async('search/concurrent', concurrent_search, make_wiki(url, 5),
+                              make_ctx(), rounds=ROUNDS)
+
+
+@pytest.mark.asyncio
+async def test_search_slow_opensearch(suite, monkeypatch):
+    async with stub_wiki({**LATENCY, 'opensearch': 2}, monkeypatch) as url:
+        await suite.run_async('search/slow-opensearch', concurrent_search, make_wiki(url, 0.5),
+                              make_ctx(), rounds=5)